@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+
+
+# ------------------------------------------------------------------------------
+# Vectorized aggregation over the allergen columns
+#
+# The allergen columns of `concatenated` are kept as one contiguous float matrix
+# (countries x allergens). Any selected subset of allergens is resolved to an
+# index array once, and the per-country sum, most prevalent and least prevalent
+# allergen are computed in a single batched pass over that matrix.
+#
+# The top allergens of every country come from a ranking precomputed once per
+# matrix: for every country, the positions of all allergens sorted by descending
+# prevalence (uint8, ties in alphabetical order). Every allergen appears once per
+# country, so the selected ones, in ranking order, are found with one lookup of the
+# selection mask, whatever the selection.
+
+class Aggregation:
+    __slots__ = ('index', 'selected_allergens', 'selected_set', 'most_prevalent_allergen', 'least_prevalent_allergen')
+
+    def __init__(self, index, selected_allergens, selected_set, most_prevalent_allergen, least_prevalent_allergen):
+        self.index = index
+        self.selected_allergens = selected_allergens
+        self.selected_set = selected_set
+        self.most_prevalent_allergen = most_prevalent_allergen
+        self.least_prevalent_allergen = least_prevalent_allergen
+
+    def to_frame(self):
+        # indexed like the frame the matrix was built from, so assignment aligns by label and not by position
+        return pd.DataFrame({'selected_set': self.selected_set,
+                             'most_prevalent_allergen': self.most_prevalent_allergen,
+                             'least_prevalent_allergen': self.least_prevalent_allergen},
+                            index=self.index)
+
+
+class AllergenRanking:
+    __slots__ = ('descending',)
+
+    def __init__(self, descending):
+        self.descending = descending
+
+    @classmethod
+    def build(cls, values, allergens):
+        # along the last axis, so a whole cube (years x countries x allergens) is ranked at once
+        alphabetical = np.argsort(np.array(allergens, dtype=object), kind='stable')
+        ordered = np.asarray(values).take(alphabetical, axis=-1)
+        dtype = np.uint8 if len(allergens) <= 256 else np.uint16
+        descending = alphabetical.take(np.argsort(-ordered, axis=-1, kind='stable')).astype(dtype)
+        descending.setflags(write=False)
+        return cls(descending)
+
+    def __getitem__(self, i):
+        # the ranking of one matrix of a cube
+        return AllergenRanking(self.descending[i])
+
+    def top(self, mask, n):
+        # column positions of the n most prevalent selected allergens of each country, most prevalent first
+        # (`mask`: one bool per column); each row holds exactly `mask.sum()` selected positions
+        rows = self.descending.shape[0]
+        selected = int(mask.sum())
+        hits = np.flatnonzero(mask.take(self.descending)).reshape(rows, selected)[:, :n]
+        return self.descending.ravel().take(hits)
+
+
+class AllergenMatrix:
+    def __init__(self, values, allergens, index=None, ranking=None):
+        self.allergens = list(allergens)
+        self.values = np.ascontiguousarray(values)
+        self.index = index if index is not None else pd.RangeIndex(self.values.shape[0])
+        self._positions = {allergen: i for i, allergen in enumerate(self.allergens)}
+        self._labels = np.array(self.allergens, dtype=object)
+        self._ranking = ranking
+
+    @property
+    def ranking(self):
+        # built on first use unless given; concurrent first uses may both build it, with the same result
+        if self._ranking is None:
+            self._ranking = AllergenRanking.build(self.values, self.allergens)
+        return self._ranking
+
+    @classmethod
+    def from_frame(cls, frame, allergens):
+        return cls(frame[list(allergens)].to_numpy(dtype=np.float64), allergens, index=frame.index)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def column_indices(self, selected_allergens):
+        # keeps the order of the selection: ties in the argmax/argmin resolve to the first selected allergen
+        return np.fromiter((self._positions[allergen] for allergen in selected_allergens),
+                           dtype=np.intp, count=len(selected_allergens))
+
+    def column_mask(self, selected_allergens):
+        mask = np.zeros(len(self.allergens), dtype=bool)
+        mask[self.column_indices(selected_allergens)] = True
+        return mask
+
+    def selected_set(self, selected_allergens):
+        if not selected_allergens:
+            return np.zeros(len(self))
+        return self.values.take(self.column_indices(selected_allergens), axis=1).sum(axis=1)
+
+    def aggregate(self, selected_allergens):
+        selected_allergens = list(selected_allergens)
+        if not selected_allergens:
+            empty = np.full(len(self), None, dtype=object)
+            return Aggregation(self.index, selected_allergens, np.zeros(len(self)), empty, empty.copy())
+
+        indices = self.column_indices(selected_allergens)
+        subset = self.values.take(indices, axis=1)
+
+        labels = self._labels[indices]
+        return Aggregation(self.index, selected_allergens,
+                           subset.sum(axis=1),
+                           labels[subset.argmax(axis=1)],
+                           labels[subset.argmin(axis=1)])
+
+    def percentile_ranks(self, position, positions, selected_allergens):
+        # per selected allergen, the percentile rank (0-100) of the row `position` among the rows `positions`:
+        # the share of them below it, ties counting half
+        indices = self.column_indices(selected_allergens)
+        values = self.values.take(positions, axis=0).take(indices, axis=1)
+        value = self.values[position].take(indices)
+        below = (values < value).sum(axis=0)
+        ties = (values == value).sum(axis=0)
+        return 100 * (below + 0.5 * ties) / max(len(positions), 1)
+
+    def top_allergens(self, selected_allergens, n):
+        # the n most prevalent selected allergens of every country and their values (countries x n)
+        if not selected_allergens:
+            return np.empty((len(self), 0), dtype=object), np.empty((len(self), 0))
+        positions = self.ranking.top(self.column_mask(selected_allergens), n)
+        return self._labels[positions], np.take_along_axis(self.values, positions.astype(np.intp), axis=1)
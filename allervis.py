@@ -1,50 +1,27 @@
+import os
+
 import dash
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State, ClientsideFunction
 
-import plotly.express as px
-import plotly.graph_objects as go
-
-import pandas as pd
-import numpy as np
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import MinMaxScaler
+import data_api
+import encoding
+import export
+import figures
+import metrics
+import normalization
+from clientside import client_payload
+from figure_patch import figure_patch
+from figure_cache import FigureCache, backend_from_url, figure_key
+from reload import DataWatcher
+from sources import data_path, allergen_paths
+from snapshot import DatasetSnapshot
 
 # ------------------------------------------------------------------------------
 # Data handling
 
-data_path = 'Food Allergies Data'
-allergen_paths = {
-    'Beef': f'{data_path}//beef-and-buffalo-meat-consumption-per-person.csv',
-    'Seafood': f'{data_path}//fish-and-seafood-consumption-per-capita.csv',
-    'Egg': f'{data_path}//per-capita-egg-consumption-kilograms-per-year.csv',
-    'Milk': f'{data_path}//per-capita-milk-consumption.csv',
-
-    # nuts:
-    'Peanut': f'{data_path}//per-capita-peanut-consumption.csv',
-    'Almond': f'{data_path}//almond-consumption-per-capita.csv',
-    'Cashew': f'{data_path}//cashew-consumption-per-capita.csv',
-    'Hazelnut': f'{data_path}//hazelnuts-consumption-per-capita.csv',
-    'Macadamia': f'{data_path}//macadamia-consumption-per-capita.csv',
-    'Pecan': f'{data_path}//pecans-consumption-per-capita.csv',
-    'Pine': f'{data_path}//pine-nuts-consumption-per-capita.csv',
-    'Pistachio': f'{data_path}//pistachios-consumption-per-capita.csv',
-    'Walnut': f'{data_path}//walnuts-consumption-per-capita.csv',
-
-    # cereals:
-    'Barley': f'{data_path}//barley-consumption-per-capita.csv',
-    'Corn': f'{data_path}//corn-maize-consumption-per-capita.csv',
-    'Oat': f'{data_path}//oats-consumption-per-capita.csv',
-    'Rice': f'{data_path}//rice-consumption-per-capita.csv',
-    'Rye': f'{data_path}//rye-consumption-per-capita.csv',
-    'Wheat': f'{data_path}//wheat-consumption-per-capita.csv',
-
-}
-
-nuts = ['Peanut', 'Almond', 'Cashew', 'Hazelnut', 'Macadamia', 'Pecan', 'Pine', 'Pistachio', 'Walnut']
-
 list_of_allergens = sorted(list(allergen_paths.keys()))
 list_of_common_allergens = sorted(['Milk', 'Egg', 'Seafood', 'Peanut', 'Wheat'])
 # ---------------------------------------------------
@@ -53,267 +30,361 @@ preprocess = False
 # missing_countries_df = pd.read_csv(f'{data_path}//countries_to_add.csv')
 
 if preprocess:
-    allergen_data = {}
-    for allergen, path in allergen_paths.items():
-        df = pd.read_csv(path)
-        allergen_data[allergen] = df
-
-    # retrieving the most recent year data for each country
-    all_dfs_most_recent_values = {}
-
-    for allergen in allergen_data.keys():
-        df = allergen_data[allergen]
-        most_recent_year = df['Year'].iloc[-1]
-
-        df_most_recent_values = df.groupby(['Code', 'Entity']).apply(lambda x: pd.Series(
-            {allergen: x[df.columns[-1]].iloc[-1]}))
-
-        all_dfs_most_recent_values[allergen] = df_most_recent_values
-
-    # concatenating all allergens into one df
-    concatenated = pd.concat(all_dfs_most_recent_values.values(), axis=1)
-
-    # imputing the missing data with the given strategy
-    imputer_median = SimpleImputer(missing_values=np.nan, strategy='median')
-    scaler = MinMaxScaler()
-
-    for column in concatenated.columns:
-        if column not in nuts:
-            concatenated[column] = imputer_median.fit_transform(np.array(concatenated[column]).reshape(-1, 1))
-        else:
-            min_col = concatenated[column].min()
-            imputer_min = SimpleImputer(missing_values=np.nan, strategy='constant', fill_value=min_col)
-            concatenated[column] = imputer_min.fit_transform(np.array(concatenated[column]).reshape(-1, 1))
-
-        max_col = concatenated[column].max()
-        concatenated[column] /= max_col
-
-    concatenated = concatenated.reset_index()
-
-    # adding continent info
-    continents = pd.read_csv(f'{data_path}//continents.csv', keep_default_na=False)
-    continents['Continent'].replace({'NA': 'NAM'}, inplace=True)
-
-    concatenated = concatenated.merge(continents, how='left', left_on='Code', right_on='alpha3').drop(
-        columns=['alpha2', 'alpha3', 'numeric', 'fips', 'Country', 'Capital', 'Area in km²'])
-
-    concatenated.to_csv(f'{data_path}//concatenated.csv', index=False)
+    # rebuilds concatenated.csv from the sources that changed since the last build (see preprocessing.py)
+    import preprocessing
+    preprocessing.build()
 # ------------------------------------------------------------------------------
 
-concatenated = pd.read_csv(f'{data_path}//concatenated.csv')
 
-app = dash.Dash()
+def load_dataset():
+    snapshot = DatasetSnapshot.load(data_path, list_of_allergens)
+    # user-defined groups of countries, e.g. subregions, offered next to the continents
+    if os.environ.get('ALLERVIS_REGIONS'):
+        snapshot.regions.load_groups(os.environ['ALLERVIS_REGIONS'])
+    return snapshot
+
+
+# loaded once and shared read-only by all requests; callbacks work on per-request views
+dataset = load_dataset()
+
+# finished figures, keyed on the dataset version and the canonicalized callback inputs
+figure_cache = FigureCache(
+    backend_from_url(os.environ.get('ALLERVIS_FIGURE_CACHE', 'memory'),
+                     max_entries=int(os.environ.get('ALLERVIS_FIGURE_CACHE_SIZE', 256)),
+                     file_entries=int(os.environ.get('ALLERVIS_FIGURE_CACHE_FILES', 4096)),
+                     ttl=int(os.environ.get('ALLERVIS_FIGURE_CACHE_TTL', 24 * 3600))),
+    version=dataset.version)
+
+# in clientside mode the browser builds the map and bar chart itself (see clientside.py)
+clientside = bool(os.environ.get('ALLERVIS_CLIENTSIDE'))
+# in patch mode the server only sends the parts of a figure that changed (see figure_patch.py)
+patch_updates = bool(os.environ.get('ALLERVIS_PATCH_UPDATES')) and not clientside
+# the number of most prevalent selected allergens listed when hovering a country of the map (server-built maps)
+hover_top = int(os.environ.get('ALLERVIS_HOVER_TOP', 0))
+# the decimals the values of server-built figures are rounded to (empty for full precision), and whether they are
+# sent as typed arrays, which need a newer Plotly.js than the one bundled with Dash 1.x (see encoding.py)
+figure_decimals = os.environ.get('ALLERVIS_FIGURE_DECIMALS', str(encoding.default_decimals))
+figure_decimals = int(figure_decimals) if figure_decimals else None
+typed_arrays = bool(os.environ.get('ALLERVIS_TYPED_ARRAYS'))
+figure_encoding = (figure_decimals, typed_arrays)
+
+# compression is set up below, with Brotli next to gzip
+app = dash.Dash(__name__, compress=False)
 server = app.server
 
+# responses compressed with whichever of ALLERVIS_COMPRESS the browser accepts ("off" to disable)
+compression = os.environ.get('ALLERVIS_COMPRESS', 'br,gzip')
+if compression != 'off':
+    encoding.register(server, algorithms=compression.split(','))
+
 # -------------------------------------------------------------------------------
 
 allergen_options = [{"label": str(allergen), "value": str(allergen)} for allergen in list_of_allergens]
 
-app.layout = html.Div([
-    html.Div([
-        html.Div([
-            # html.P("AllerVis", className="control_label"),
-            "AllerVis | ",
-            html.Div(
-                dbc.Button(
-                    "Help", id="popover-target"
-                ),
-                style={'display': 'inline-block', 'font-size': '25px',
-                       'margin-bottom': '2px',
-                       "font-family": "Helvetica"
-                       },
 
-            )
-        ],
-            style={'margin': '2px 5px', 'padding': '2px 10px', 'font-size': '25px', 'text-align': 'left',
-                   "font-family": "Helvetica", "font-weight": "bold",
-                   # "background-color": "#f9f9f9",
-                   'background-image': 'linear-gradient(to left, rgba(64, 78, 119,0), rgba(64, 78, 119,5))',
-                   'color': 'white'
-                   }
-        ),
+def serve_layout():
+    # a function, so that every page load shows the dataset being served, also after a reload
+    snapshot = dataset
+    return html.Div([
+        html.Div([
+            html.Div([
+                # html.P("AllerVis", className="control_label"),
+                "AllerVis | ",
+                html.Div(
+                    dbc.Button(
+                        "Help", id="popover-target"
+                    ),
+                    style={'display': 'inline-block', 'font-size': '25px',
+                           'margin-bottom': '2px',
+                           "font-family": "Helvetica"
+                           },
 
-        dbc.Popover(
-            [
-                dbc.PopoverHeader("Instructions:"),
-                dbc.PopoverBody(" - Single click on a legend item to exclude"),
-                dbc.PopoverBody(" - Double click on a legend item to isolate"),
-                dbc.PopoverBody(" - Use drag and scroll to change the view of the map"),
-                dbc.PopoverBody(" - Double click anywhere to reset the view"),
-                dbc.PopoverHeader("Information: "),
-                dbc.PopoverBody(" - Choropleth: color encodes aggregated prevalence (saturation)/category "
-                                "of the least or most prevalent allergen (hue)"),
-                dbc.PopoverBody(" - Bubble map: size encodes aggregated prevalence"),
-                dbc.PopoverBody(" - Bubble map: color encodes aggregated prevalence (saturation)/category "
-                                "of the least or most prevalent allergen (hue)"),
+                )
             ],
-            id="popover",
-            is_open=False,
-            target="popover-target",
-            placement='bottom-start',
-            style={"background-color": "rgba(0, 0, 0, 0.8)",
-                   'font-size': '15px', 'color': 'white',
-                   'margin': '5px', 'padding': '0px 5px 5px 5px',
-                   "font-family": "Segoe UI", 'border-radius': '6px'
-                   }
+                style={'margin': '2px 5px', 'padding': '2px 10px', 'font-size': '25px', 'text-align': 'left',
+                       "font-family": "Helvetica", "font-weight": "bold",
+                       # "background-color": "#f9f9f9",
+                       'background-image': 'linear-gradient(to left, rgba(64, 78, 119,0), rgba(64, 78, 119,5))',
+                       'color': 'white'
+                       }
+            ),
 
-        ),
+            dbc.Popover(
+                [
+                    dbc.PopoverHeader("Instructions:"),
+                    dbc.PopoverBody(" - Single click on a legend item to exclude"),
+                    dbc.PopoverBody(" - Double click on a legend item to isolate"),
+                    dbc.PopoverBody(" - Use drag and scroll to change the view of the map"),
+                    dbc.PopoverBody(" - Double click anywhere to reset the view"),
+                    dbc.PopoverHeader("Information: "),
+                    dbc.PopoverBody(" - Choropleth: color encodes aggregated prevalence (saturation)/category "
+                                    "of the least or most prevalent allergen (hue)"),
+                    dbc.PopoverBody(" - Bubble map: size encodes aggregated prevalence"),
+                    dbc.PopoverBody(" - Bubble map: color encodes aggregated prevalence (saturation)/category "
+                                    "of the least or most prevalent allergen (hue)"),
+                ],
+                id="popover",
+                is_open=False,
+                target="popover-target",
+                placement='bottom-start',
+                style={"background-color": "rgba(0, 0, 0, 0.8)",
+                       'font-size': '15px', 'color': 'white',
+                       'margin': '5px', 'padding': '0px 5px 5px 5px',
+                       "font-family": "Segoe UI", 'border-radius': '6px'
+                       }
 
-        html.Div(
-            [
-                html.Div([
+            ),
+
+            html.Div(
+                [
                     html.Div([
-                        html.P("Filter by allergen:", className="control_label"),
+                        html.Div([
+                            html.P("Filter by allergen:", className="control_label"),
+                        ],
+                            style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                        ),
+
+                        html.Div([
+                            dcc.RadioItems(
+                                id="allergen_selector",
+                                options=[
+                                    {"label": "Common ", "value": "common"},
+                                    {"label": "Custom ", "value": "custom"},
+                                    {"label": "All ", "value": "all"},
+                                ],
+                                value="common",
+                                labelStyle={"display": "inline-block"},
+                                className="dcc_control",
+                            ),
+                        ],
+                            style={'margin': '5px', 'display': 'inline-block'}
+                        ),
                     ],
-                        style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                        style={'margin': '5px'}),
+
+                    dcc.Dropdown(
+                        id="allergens",
+                        options=allergen_options,
+                        multi=True,
+                        value=list_of_allergens,
+                        className="dcc_control",
                     ),
+                    html.Div([
+                        html.Div([
+                            html.P("Filter by region:", className="control_label"),
+                        ],
+                            style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                        ),
+                        html.Div([
+                            dcc.Dropdown(
+                                id="regions",
+                                options=snapshot.regions.options(),
+                                multi=False,
+                                value='world',
+                                className="dcc_control",
+                            ),
+                        ],
+                            style={'margin': '5px', 'width': '200px', 'height': '20px',
+                                   'font-size': "100%", 'display': 'inline-block'}
+                        )
+                    ]),
 
+                    html.Div([
+                        html.Div([
+                            html.P("Select map idiom:", className="control_label"),
+                        ],
+                            style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                        ),
+
+                        html.Div([
+                            dcc.RadioItems(
+                                id="map_idiom_selector",
+                                options=[
+                                    {"label": "Choropleth ", "value": "choropleth"},
+                                    {"label": "Bubble map ", "value": "bubble"}
+                                ],
+                                value="choropleth",
+                                labelStyle={"display": "inline-block"},
+                                className="dcc_control",
+                            ),
+                        ],
+                            style={'margin': '5px', 'display': 'inline-block'}
+                        )
+                    ]),
+
+                    html.P("Select color scheme:", className="control_label"),
                     html.Div([
                         dcc.RadioItems(
-                            id="allergen_selector",
+                            id="color_scheme_selector",
                             options=[
-                                {"label": "Common ", "value": "common"},
-                                {"label": "Custom ", "value": "custom"},
-                                {"label": "All ", "value": "all"},
+                                {"label": "Sequential ", "value": "sequential"},
+                                {"label": "Most Prevalent ", "value": "mpa"},
+                                {"label": "Least Prevalent ", "value": "lpa"},
                             ],
-                            value="common",
+                            value="mpa",
                             labelStyle={"display": "inline-block"},
                             className="dcc_control",
                         ),
                     ],
-                        style={'margin': '5px', 'display': 'inline-block'}
-                    ),
-                ],
-                    style={'margin': '5px'}),
-
-                dcc.Dropdown(
-                    id="allergens",
-                    options=allergen_options,
-                    multi=True,
-                    value=list_of_allergens,
-                    className="dcc_control",
-                ),
-                html.Div([
-                    html.Div([
-                        html.P("Filter by region:", className="control_label"),
-                    ],
-                        style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
-                    ),
+                        style={'margin': '5px'}),
+
                     html.Div([
-                        dcc.Dropdown(
-                            id="regions",
-                            options=[{"label": "World ", "value": "world"},
-                                     {"label": "Europe ", "value": "europe"},
-                                     {"label": "Asia ", "value": "asia"},
-                                     {"label": "Africa ", "value": "africa"},
-                                     {"label": "North America ", "value": "north america"},
-                                     {"label": "South America ", "value": "south america"},
-                                     {"label": "Oceania ", "value": "oceania"},
-
-                                     ],
-                            multi=False,
-                            value='world',
-                            className="dcc_control",
+                        html.Div([
+                            html.P("Select year:", className="control_label"),
+                        ],
+                            style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                        ),
+
+                        html.Div([
+                            dcc.RadioItems(
+                                id="year_mode",
+                                options=[
+                                    {"label": "Most recent ", "value": "latest"},
+                                    {"label": "By year ", "value": "year"},
+                                ] + ([] if clientside else [{"label": "Animate ", "value": "animate"}]),
+                                value="latest",
+                                labelStyle={"display": "inline-block"},
+                                className="dcc_control",
+                            ),
+                        ],
+                            style={'margin': '5px', 'display': 'inline-block'}
+                        ),
+
+                        dcc.Slider(
+                            id="year_slider",
+                            min=min(snapshot.years, default=0),
+                            max=max(snapshot.years, default=0),
+                            step=1,
+                            value=max(snapshot.years, default=0),
+                            marks={year: str(year) for year in snapshot.years if year % 10 == 0},
+                            tooltip={'placement': 'bottom'},
+                            disabled=True,
                         ),
                     ],
-                        style={'margin': '5px', 'width': '200px', 'height': '20px',
-                               'font-size': "100%", 'display': 'inline-block'}
-                    )
-                ]),
+                        # the time series is only available when the app loads the binary artifact
+                        style={'margin': '5px'} if snapshot.years else {'display': 'none'}),
 
-                html.Div([
                     html.Div([
-                        html.P("Select map idiom:", className="control_label"),
+                        html.Div([
+                            html.Div([
+                                html.P("Scaling:", className="control_label"),
+                            ],
+                                style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                            ),
+                            html.Div([
+                                dcc.Dropdown(
+                                    id="scaling_selector",
+                                    options=normalization.options(normalization.scalings),
+                                    multi=False,
+                                    clearable=False,
+                                    value=normalization.default_scaling,
+                                    className="dcc_control",
+                                ),
+                            ],
+                                style={'margin': '5px', 'width': '200px', 'height': '20px',
+                                       'font-size': "100%", 'display': 'inline-block'}
+                            )
+                        ]),
+                        html.Div([
+                            html.Div([
+                                html.P("Missing values:", className="control_label"),
+                            ],
+                                style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
+                            ),
+                            html.Div([
+                                dcc.Dropdown(
+                                    id="imputation_selector",
+                                    options=normalization.options(normalization.imputations),
+                                    multi=False,
+                                    clearable=False,
+                                    value=normalization.default_imputation,
+                                    className="dcc_control",
+                                ),
+                            ],
+                                style={'margin': '5px', 'width': '200px', 'height': '20px',
+                                       'font-size': "100%", 'display': 'inline-block'}
+                            )
+                        ]),
                     ],
-                        style={'width': '30%', 'height': '2px', 'display': 'inline-block'}
-                    ),
+                        # other strategies are computed from the raw values of the binary artifact
+                        style={} if snapshot.strategies_available else {'display': 'none'}),
 
+                ],
+                className="pretty_container",
+                id="cross-filter-options",
+                style={"width": "38%", "padding": 10, "margin": "5px", "background-color": "#f9f9f9",
+                       'display': 'inline-block', 'vertical-align': 'top', 'min-height': '355px',
+                       'position': 'relative',
+                       "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)",
+                       "font-family": "Helvetica"},
+            ),
+
+            html.Div(
+                [
                     html.Div([
-                        dcc.RadioItems(
-                            id="map_idiom_selector",
-                            options=[
-                                {"label": "Choropleth ", "value": "choropleth"},
-                                {"label": "Bubble map ", "value": "bubble"}
-                            ],
-                            value="choropleth",
-                            labelStyle={"display": "inline-block"},
-                            className="dcc_control",
-                        ),
+                        dcc.Graph(id="map_graph",
+                                  config={'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
+                                          'displaylogo': False})
                     ],
-                        style={'margin': '5px', 'display': 'inline-block'}
-                    )
-                ]),
-
-                html.P("Select color scheme:", className="control_label"),
-                html.Div([
-                    dcc.RadioItems(
-                        id="color_scheme_selector",
-                        options=[
-                            {"label": "Sequential ", "value": "sequential"},
-                            {"label": "Most Prevalent ", "value": "mpa"},
-                            {"label": "Least Prevalent ", "value": "lpa"},
-                        ],
-                        value="mpa",
-                        labelStyle={"display": "inline-block"},
-                        className="dcc_control",
+                        id="map_container",
+                        className="map_container",
+                        style={'margin-top': '20px'}
                     ),
                 ],
-                    style={'margin': '5px'}),
-
-            ],
-            className="pretty_container",
-            id="cross-filter-options",
-            style={"width": "38%", "padding": 10, "margin": "5px", "background-color": "#f9f9f9",
-                   'display': 'inline-block', 'vertical-align': 'top', 'min-height': '355px',
-                   'position': 'relative',
-                   "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)",
-                   "font-family": "Helvetica"},
-        ),
+                id="map_area",
+                className="map area",
+                style={"margin": "5px", "width": "58%", "height": "375px",
+                       'display': 'inline-block', 'position': 'relative',
+                       "background-color": "#ffffff",
+                       "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)"}
+            ),
 
-        html.Div(
-            [
-                html.Div([
-                    dcc.Graph(id="map_graph",
-                              config={'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
-                                      'displaylogo': False})
+            html.Div(
+                [
+                    html.Div(
+                        [dcc.Graph(id="stack_barchart_graph",
+                                   config={'modeBarButtonsToRemove': ['lasso2d'],
+                                           'displaylogo': False})],
+                        id="stack_barchart_container",
+                        className="pretty_container",
+                    ),
                 ],
-                    id="map_container",
-                    className="map_container",
-                    style={'margin-top': '20px'}
-                ),
-            ],
-            id="map_area",
-            className="map area",
-            style={"margin": "5px", "width": "58%", "height": "375px",
-                   'display': 'inline-block', 'position': 'relative',
-                   "background-color": "#ffffff",
-                   "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)"}
+                id="stack_barchart_area",
+                className="stack barchart area",
+                style={"margin": "5px",
+                       "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)",
+                       }
+            ),
+        ],
+            className="flex-display",
         ),
 
+        # the drill-down of the country clicked on the map
         html.Div(
             [
-                html.Div(
-                    [dcc.Graph(id="stack_barchart_graph",
-                               config={'modeBarButtonsToRemove': ['lasso2d'],
-                                       'displaylogo': False})],
-                    id="stack_barchart_container",
-                    className="pretty_container",
-                ),
+                html.Button("Close", id="country_close", n_clicks=0,
+                            style={'float': 'right', 'margin': '5px', 'font-family': 'Helvetica'}),
+                dcc.Graph(id="country_graph", config={'displaylogo': False}),
             ],
-            id="stack_barchart_area",
-            className="stack barchart area",
-            style={"margin": "5px",
-                   "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)",
-                   }
+            id="country_area",
+            className="pretty_container",
+            style={'display': 'none'},
         ),
+
+        dcc.Store(id="allergen_store"),
+        dcc.Store(id="country_request"),
+        dcc.Store(id="map_patch"),
+        dcc.Store(id="map_key"),
+        dcc.Store(id="barchart_patch"),
+        dcc.Store(id="barchart_key"),
+
     ],
-        className="flex-display",
-    ),
+        id="mainContainer",
+        style={"padding": '10px', "background-color": "#f2f2f2"},
+    )
 
-],
-    id="mainContainer",
-    style={"padding": '10px', "background-color": "#f2f2f2"},
-)
+
+app.layout = serve_layout
 
 
 # Radio -> multi
@@ -331,35 +402,46 @@ def display_status(selector):
 
 # -------------------------------------------------------------------------------------------
 # Graph
-@app.callback(
-    Output("stack_barchart_graph", "figure"),
-    [Input("allergens", "value"), Input("regions", "value")]
-)
-def update_plot(selected_allergens, selected_region):
-    selected_allergens.sort()
+def build_barchart(selected_allergens, selected_region, year=None, strategy=None, snapshot=None):
+    # one snapshot per figure, even when a reload (see reload.py) replaces it meanwhile
+    snapshot = dataset if snapshot is None else snapshot
+    return figures.barchart(snapshot, selected_allergens, snapshot.regions.get(selected_region), year, strategy,
+                            *figure_encoding)
+
+
+def build_map(selected_allergens, selected_region, map_idiom, color_scheme, year=None, animate=False, strategy=None,
+              snapshot=None):
+    if animate:
+        # the animation frames and controls are left to Plotly Express
+        with metrics.stage('build'):
+            return build_map_express(selected_allergens, selected_region, map_idiom, color_scheme, animate=True,
+                                     strategy=strategy, snapshot=snapshot)
+    snapshot = dataset if snapshot is None else snapshot
+    return figures.geo_map(snapshot, selected_allergens, snapshot.regions.get(selected_region), map_idiom,
+                           color_scheme, year, strategy, hover_top, *figure_encoding)
+
+
+# -------------------------------------------------------------------------------------------
+# Plotly Express versions of the figures (the reference for figures.py)
+#
+# Plotly Express is only imported when one of them runs, which keeps it out of
+# the workers' startup (see benchmarks/check_serving_imports.py)
+
+def build_barchart_express(selected_allergens, selected_region, year=None, strategy=None, snapshot=None):
+    import plotly.express as px
+
+    selected_allergens = sorted(selected_allergens)
     ascending = True
 
-    concatenated['selected_set'] = concatenated.apply(lambda row: row[selected_allergens].sum(), axis=1)
-    concatenated.sort_values('selected_set', ascending=ascending, inplace=True)
-
-    region_concatenated = concatenated
-    showticklabels = True
-
-    if selected_region == 'world':
-        region_concatenated = concatenated
-        showticklabels = False
-    elif selected_region == 'europe':
-        region_concatenated = concatenated[concatenated['Continent'] == 'EU']
-    elif selected_region == 'asia':
-        region_concatenated = concatenated[concatenated['Continent'] == 'AS']
-    elif selected_region == 'africa':
-        region_concatenated = concatenated[concatenated['Continent'] == 'AF']
-    elif selected_region == 'north america':
-        region_concatenated = concatenated[concatenated['Continent'] == "NAM"]
-    elif selected_region == 'south america':
-        region_concatenated = concatenated[concatenated['Continent'] == 'SA']
-    elif selected_region == 'oceania':
-        region_concatenated = concatenated[concatenated['Continent'] == 'OC']
+    snapshot = dataset if snapshot is None else snapshot
+    concatenated = snapshot.view(selected_allergens, year, strategy)
+
+    region = snapshot.regions.get(selected_region)
+    order = snapshot.regions.order(region.value, concatenated['selected_set'].to_numpy())
+    if not ascending:
+        order = order[::-1]
+    region_concatenated = concatenated.take(order)
+    showticklabels = not region.is_world
 
     fig = px.bar(region_concatenated, x='Entity', y=selected_allergens, orientation='v', height=400,
                  labels={'variable': 'Allergen',
@@ -397,22 +479,20 @@ def update_plot(selected_allergens, selected_region):
 
 # -------------------------------------------------------------------------------------
 
-@app.callback(
-    Output("map_graph", "figure"),
-    [Input("allergens", "value"),
-     Input("regions", "value"),
-     Input("map_idiom_selector", "value"),
-     Input("color_scheme_selector", "value")
-     ]
-)
-def update_plot(selected_allergens, selected_region, map_idiom, color_scheme):
-    concatenated['selected_set'] = concatenated.apply(lambda row: row[selected_allergens].sum(), axis=1)
-    concatenated['most_prevalent_allergen'] = concatenated.apply(
-        lambda row: row[selected_allergens][row[selected_allergens] == row[selected_allergens].max()].index[0],
-        axis=1)
-    concatenated['least_prevalent_allergen'] = concatenated.apply(
-        lambda row: row[selected_allergens][row[selected_allergens] == row[selected_allergens].min()].index[0],
-        axis=1)
+def build_map_express(selected_allergens, selected_region, map_idiom, color_scheme, year=None, animate=False,
+                      strategy=None, snapshot=None):
+    import plotly.express as px
+
+    selected_allergens = sorted(selected_allergens)
+
+    animation = {}
+    snapshot = dataset if snapshot is None else snapshot
+    if animate:
+        # one frame per year of the cube
+        concatenated = snapshot.animation_view(selected_allergens, strategy)
+        animation = dict(animation_frame='Year', category_orders={'Year': snapshot.years})
+    else:
+        concatenated = snapshot.view(selected_allergens, year, strategy)
 
     color = 'selected_set'
     color_continuous_scale = px.colors.sequential.Blues
@@ -432,10 +512,8 @@ def update_plot(selected_allergens, selected_region, map_idiom, color_scheme):
 
     fig = 0
 
-    if selected_region == 'oceania':
-        scope = 'world'
-    else:
-        scope = selected_region
+    region = snapshot.regions.get(selected_region)
+    scope = region.scope
 
     if map_idiom == 'choropleth':
         fig = px.choropleth(data_frame=concatenated,
@@ -452,6 +530,7 @@ def update_plot(selected_allergens, selected_region, map_idiom, color_scheme):
                             title=None,
                             height=340,
                             # hover_data=selected_allergens # Removing due to current lag
+                            **animation
                             )
         fig.update_layout(
             margin=dict(
@@ -471,26 +550,37 @@ def update_plot(selected_allergens, selected_region, map_idiom, color_scheme):
             )
         )
 
-        if selected_region == 'world':
+        if scope == 'world':
             fig.update_geos(visible=False)
 
-        if selected_region == 'oceania':
-            fig.update_geos(visible=False, center=dict(lon=130, lat=-30), projection_scale=3)
+        if region.geo:
+            fig.update_geos(**region.geo)
 
     elif map_idiom == 'bubble':
 
+        size = 'selected_set'
+        bubble = {}
+        if concatenated['selected_set'].min() < 0:
+            # some strategies (z-scores) give negative values: as in figures.geo_traces, bubbles grow from the
+            # smallest value (of every frame) instead of zero, and the hover shows the values themselves
+            size = 'bubble_size'
+            concatenated[size] = concatenated['selected_set'] - concatenated['selected_set'].min()
+            bubble = dict(hover_data={'selected_set': True, size: False})
+
         fig = px.scatter_geo(concatenated,
                              locations='Code',
                              scope=scope,
                              color=color,
-                             size='selected_set',
+                             size=size,
                              hover_name="Entity",  # column to add to hover information
                              color_continuous_scale=color_continuous_scale,
                              labels={'selected_set': 'Prevalence',
                                      'most_prevalent_allergen': 'Most Prevalent Allergen',
                                      'least_prevalent_allergen': 'Least Prevalent Allergen'},
                              title=None,
-                             height=340
+                             height=340,
+                             **animation,
+                             **bubble
                              )
 
         fig.update_layout(
@@ -511,14 +601,268 @@ def update_plot(selected_allergens, selected_region, map_idiom, color_scheme):
             )
         )
 
-        if selected_region == 'oceania':
-            fig.update_geos(center=dict(lon=130, lat=-30),
-                            projection_scale=3)
+        if region.geo:
+            fig.update_geos(**region.geo)
 
         # fig.update_config({'modeBarButtonsToRemove': ['lasso2d']})
     return fig
 
 
+# -------------------------------------------------------------------------------------
+# Cached figures
+
+def selected_year(year_mode, year):
+    # the year whose values are shown, None for the most recent value of every country
+    return year if year_mode == 'year' else None
+
+
+# Figures are cached under the version of the snapshot they are built from, which the callbacks read once: a
+# reload (see reload.py) meanwhile never files a figure of the previous snapshot under the new version
+
+def barchart_figure(selected_allergens, selected_region, year=None, strategy=None, snapshot=None):
+    snapshot = dataset if snapshot is None else snapshot
+    strategy = strategy or normalization.default_strategy
+    key = figure_key('barchart', selected_allergens, selected_region, year, strategy, *figure_encoding)
+    return figure_cache.get_or_build(key, lambda: build_barchart(selected_allergens, selected_region, year, strategy,
+                                                                 snapshot), snapshot.version)
+
+
+def map_figure(selected_allergens, selected_region, map_idiom, color_scheme, year=None, animate=False, strategy=None,
+               snapshot=None):
+    snapshot = dataset if snapshot is None else snapshot
+    strategy = strategy or normalization.default_strategy
+    key = figure_key('map', selected_allergens, selected_region, map_idiom, color_scheme,
+                     'animate' if animate else year, hover_top, strategy, *figure_encoding)
+    return figure_cache.get_or_build(key, lambda: build_map(selected_allergens, selected_region, map_idiom,
+                                                            color_scheme, year, animate, strategy, snapshot),
+                                     snapshot.version)
+
+
+def country_figure(code, selected_allergens, selected_region, year=None, strategy=None, snapshot=None):
+    snapshot = dataset if snapshot is None else snapshot
+    strategy = strategy or normalization.default_strategy
+    key = figure_key('country', selected_allergens, code, selected_region, year, strategy, *figure_encoding)
+    return figure_cache.get_or_build(
+        key, lambda: figures.country_panel(snapshot, code, selected_allergens, snapshot.regions.get(selected_region),
+                                           year, strategy, *figure_encoding),
+        snapshot.version)
+
+
+def prewarm_figure_cache():
+    # the "common" and "all" presets of the allergen selector dominate traffic
+    regions = [option['value'] for option in dataset.regions.options()]
+    for selected_allergens in (list_of_common_allergens, list_of_allergens):
+        for selected_region in regions:
+            barchart_figure(selected_allergens, selected_region)
+            for map_idiom in figures.map_idioms:
+                for color_scheme in figures.color_schemes:
+                    map_figure(selected_allergens, selected_region, map_idiom, color_scheme)
+
+
+@app.callback(
+    Output("year_slider", "disabled"),
+    [Input("year_mode", "value")]
+)
+def toggle_year_slider(year_mode):
+    return year_mode != 'year'
+
+
+# the values of the controls, for the labels of the callback metrics
+year_modes = ('latest', 'year', 'animate')
+
+
+def barchart_inputs_label(selected_region, year_mode):
+    return metrics.inputs_label((selected_region, dataset.regions), (year_mode, year_modes))
+
+
+def map_inputs_label(selected_region, map_idiom, color_scheme, year_mode):
+    return metrics.inputs_label((selected_region, dataset.regions), (map_idiom, figures.map_idioms),
+                                (color_scheme, figures.color_schemes), (year_mode, year_modes))
+
+
+def update_barchart(selected_allergens, selected_region, year_mode, year, imputation=None, scaling=None):
+    with metrics.callback('barchart', barchart_inputs_label(selected_region, year_mode)):
+        return barchart_figure(selected_allergens, selected_region, selected_year(year_mode, year),
+                               normalization.strategy_name(imputation, scaling))
+
+
+def update_map(selected_allergens, selected_region, map_idiom, color_scheme, year_mode, year,
+               imputation=None, scaling=None):
+    with metrics.callback('map', map_inputs_label(selected_region, map_idiom, color_scheme, year_mode)):
+        return map_figure(selected_allergens, selected_region, map_idiom, color_scheme,
+                          selected_year(year_mode, year), animate=year_mode == 'animate',
+                          strategy=normalization.strategy_name(imputation, scaling))
+
+
+def update_allergen_store(year_mode, year, imputation=None, scaling=None):
+    with metrics.callback('allergen_store', metrics.inputs_label((year_mode, year_modes))):
+        return client_payload(dataset, selected_year(year_mode, year),
+                              strategy=normalization.strategy_name(imputation, scaling))
+
+
+def update_barchart_patch(selected_allergens, selected_region, year_mode, year, imputation, scaling, client_key):
+    snapshot = dataset
+    with metrics.callback('barchart', barchart_inputs_label(selected_region, year_mode)):
+        figure = barchart_figure(selected_allergens, selected_region, selected_year(year_mode, year),
+                                 normalization.strategy_name(imputation, scaling), snapshot)
+        # the rows of another version may be other countries, or in another order
+        with metrics.stage('patch'):
+            return figure_patch(figure, [snapshot.version, selected_region], client_key)
+
+
+def update_map_patch(selected_allergens, selected_region, map_idiom, color_scheme, year_mode, year,
+                     imputation, scaling, client_key):
+    if year_mode == 'animate':
+        # the frames are part of the figure itself
+        client_key = None
+    snapshot = dataset
+    with metrics.callback('map', map_inputs_label(selected_region, map_idiom, color_scheme, year_mode)):
+        figure = map_figure(selected_allergens, selected_region, map_idiom, color_scheme,
+                            selected_year(year_mode, year), animate=year_mode == 'animate',
+                            strategy=normalization.strategy_name(imputation, scaling), snapshot=snapshot)
+        # the sequential scheme draws every country in one trace, always in the same order (within a version)
+        with metrics.stage('patch'):
+            return figure_patch(figure, [snapshot.version, selected_region, map_idiom, color_scheme,
+                                         year_mode == 'animate'],
+                                client_key, same_traces=color_scheme == 'sequential')
+
+
+country_style = {"margin": "5px", "background-color": "#ffffff",
+                 "box-shadow": "0 4px 8px 0 rgba(0, 0, 0, 0.05), 0 6px 20px 0 rgba(0, 0, 0, 0.05)"}
+
+
+def update_country_figure(code, selected_allergens, selected_region, year_mode, year, imputation=None, scaling=None):
+    with metrics.callback('country', metrics.inputs_label((selected_region, dataset.regions))):
+        return country_figure(code, selected_allergens or [], selected_region, selected_year(year_mode, year),
+                              normalization.strategy_name(imputation, scaling))
+
+
+# The browser decides when the server is asked for a drill-down (`request_country` in assets/allervis.js): on a
+# click on the map, on Close, and on a change of the controls while the panel is open. The request holds the code of
+# the country and the controls; it is null when the panel is closed.
+app.clientside_callback(
+    ClientsideFunction(namespace="allervis", function_name="request_country"),
+    Output("country_request", "data"),
+    [Input("map_graph", "clickData"),
+     Input("country_close", "n_clicks"),
+     Input("allergens", "value"),
+     Input("regions", "value"),
+     Input("year_mode", "value"),
+     Input("year_slider", "value"),
+     Input("imputation_selector", "value"),
+     Input("scaling_selector", "value")
+     ],
+    [State("country_request", "data")]
+)
+
+
+@app.callback(
+    [Output("country_graph", "figure"), Output("country_area", "style")],
+    [Input("country_request", "data")],
+    prevent_initial_call=True
+)
+def update_country(request):
+    code = (request or {}).get('code')
+    if code is None or dataset.regions.position(code) is None:
+        return dash.no_update, {'display': 'none'}
+    return (update_country_figure(code, request['allergens'], request['region'], request['year_mode'],
+                                  request['year'], request['imputation'], request['scaling']),
+            country_style)
+
+
+if clientside:
+    # the server only sends the allergen matrix, once per selected year
+    app.callback(
+        Output("allergen_store", "data"),
+        [Input("year_mode", "value"), Input("year_slider", "value"),
+         Input("imputation_selector", "value"), Input("scaling_selector", "value")]
+    )(update_allergen_store)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="allervis", function_name="update_barchart"),
+        Output("stack_barchart_graph", "figure"),
+        [Input("allergen_store", "data"),
+         Input("allergens", "value"),
+         Input("regions", "value")
+         ]
+    )
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="allervis", function_name="update_map"),
+        Output("map_graph", "figure"),
+        [Input("allergen_store", "data"),
+         Input("allergens", "value"),
+         Input("regions", "value"),
+         Input("map_idiom_selector", "value"),
+         Input("color_scheme_selector", "value")
+         ]
+    )
+elif patch_updates:
+    app.callback(
+        Output("barchart_patch", "data"),
+        [Input("allergens", "value"),
+         Input("regions", "value"),
+         Input("year_mode", "value"),
+         Input("year_slider", "value"),
+         Input("imputation_selector", "value"),
+         Input("scaling_selector", "value")
+         ],
+        [State("barchart_key", "data")]
+    )(update_barchart_patch)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="allervis", function_name="apply_patch"),
+        [Output("stack_barchart_graph", "figure"), Output("barchart_key", "data")],
+        [Input("barchart_patch", "data")],
+        [State("stack_barchart_graph", "figure"), State("barchart_key", "data")]
+    )
+
+    app.callback(
+        Output("map_patch", "data"),
+        [Input("allergens", "value"),
+         Input("regions", "value"),
+         Input("map_idiom_selector", "value"),
+         Input("color_scheme_selector", "value"),
+         Input("year_mode", "value"),
+         Input("year_slider", "value"),
+         Input("imputation_selector", "value"),
+         Input("scaling_selector", "value")
+         ],
+        [State("map_key", "data")]
+    )(update_map_patch)
+
+    app.clientside_callback(
+        ClientsideFunction(namespace="allervis", function_name="apply_patch"),
+        [Output("map_graph", "figure"), Output("map_key", "data")],
+        [Input("map_patch", "data")],
+        [State("map_graph", "figure"), State("map_key", "data")]
+    )
+else:
+    app.callback(
+        Output("stack_barchart_graph", "figure"),
+        [Input("allergens", "value"),
+         Input("regions", "value"),
+         Input("year_mode", "value"),
+         Input("year_slider", "value"),
+         Input("imputation_selector", "value"),
+         Input("scaling_selector", "value")
+         ]
+    )(update_barchart)
+
+    app.callback(
+        Output("map_graph", "figure"),
+        [Input("allergens", "value"),
+         Input("regions", "value"),
+         Input("map_idiom_selector", "value"),
+         Input("color_scheme_selector", "value"),
+         Input("year_mode", "value"),
+         Input("year_slider", "value"),
+         Input("imputation_selector", "value"),
+         Input("scaling_selector", "value")
+         ]
+    )(update_map)
+
+
 # ------------------------------------------------------------------------
 
 @app.callback(
@@ -531,8 +875,63 @@ def toggle_popover(n, is_open):
         return not is_open
     return is_open
 
+# ---------------------------------------------------------------------------------------
+# PNG/SVG snapshots of the figures under /export (see export.py)
+
+export_pool = export.RenderPool(workers=int(os.environ.get('ALLERVIS_EXPORT_WORKERS', 2)),
+                                topojson=os.environ.get('ALLERVIS_TOPOJSON'))
+
+
+def current_dataset():
+    return dataset
+
+
+export.register(server, current_dataset, export_pool, map_figure, barchart_figure,
+                default_allergens=list_of_common_allergens)
+
+# per-country prevalence tables under /api (see data_api.py)
+
+data_api.register(server, current_dataset)
+
+# latency histograms, response sizes and cache hit ratios on /metrics (see metrics.py)
+
+metrics.profiler.rate = float(os.environ.get('ALLERVIS_PROFILE', 0))
+metrics.register(server, outputs=app.callback_map)
+metrics.registry.value('allervis_figure_cache_hits_total', 'Figure lookups answered by the figure cache',
+                       lambda: figure_cache.hits, kind='counter')
+metrics.registry.value('allervis_figure_cache_misses_total', 'Figure lookups that built the figure',
+                       lambda: figure_cache.misses, kind='counter')
+metrics.registry.value('allervis_figure_cache_hit_ratio', 'Share of the figure lookups answered by the cache',
+                       lambda: figure_cache.stats()['hit_ratio'])
+metrics.registry.value('allervis_export_cache_hits_total', 'Exported images answered by the image cache',
+                       lambda: export_pool.hits, kind='counter')
+metrics.registry.value('allervis_export_renders_total', 'Exported images rendered by Kaleido',
+                       lambda: export_pool.renders, kind='counter')
+
+# ---------------------------------------------------------------------------------------
+# Hot reload of updated source files (see reload.py)
+
+def swap_dataset(snapshot):
+    # callbacks read `dataset` once per figure and cache it under that snapshot's version (see barchart_figure);
+    # the cache version only moves on to drop the in-process entries of the previous one
+    global dataset
+    dataset = snapshot
+    figure_cache.set_version(snapshot.version)
+    export_pool.images.clear()
+
+
+if os.environ.get('ALLERVIS_WATCH'):
+    watcher = DataWatcher(data_path, load_dataset, swap_dataset, version=dataset.version,
+                          interval=float(os.environ['ALLERVIS_WATCH'])).start()
+    metrics.registry.value('allervis_data_reloads_total', 'Updated datasets swapped in without a restart',
+                           lambda: watcher.reloads, kind='counter')
+    metrics.registry.value('allervis_data_reload_failures_total', 'Failed rebuilds and reloads of the data',
+                           lambda: watcher.failures, kind='counter')
+
 # ---------------------------------------------------------------------------------------
 
+if os.environ.get('ALLERVIS_PREWARM'):
+    prewarm_figure_cache()
 
 if __name__ == '__main__':
     app.run_server()
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds and reloads are not coordinated between processes
+    fcntl = None
+
+
+# ------------------------------------------------------------------------------
+# Columnar binary artifact of `concatenated.csv`
+#
+# Written by the build stage next to the CSV, one raw `.npy` file per column:
+#   allergens.npy   float32 (countries x allergens), allergens in sorted order
+#   codes.npy       fixed-width country codes (ISO alpha-3 and a few OWID_*), the row index
+#   entity.npy      int16 codes into meta['entities']
+#   continent.npy   int8 codes into meta['continents'] (-1 when unknown)
+#   population.npy  float64 (NaN when unknown)
+#   years.npy       int16 years of the time-series cube
+#   cube.npy        float32 (years x countries x allergens), one allergen matrix per year
+#   raw.npy         float32 (countries x allergens), the values before imputation and
+#                   scaling, NaN when missing (see normalization.py)
+#   raw_cube.npy    float32 (years x countries x allergens), the values before imputation
+#                   and scaling for every year. The years a country has no value for take
+#                   its nearest earlier (else later) one (see preprocessing.fill_years), so
+#                   only countries without any value in a source are NaN
+#   history.npy     float32 (countries x years x allergens), the values of the sources,
+#                   NaN for the years they have no value for. Country-major: the whole
+#                   history of a country is one contiguous block (see history_store.py)
+# plus meta.json with the category labels and the version (hash) of the CSV it was
+# built from. Workers open the arrays with mmap_mode='r', so processes forked by
+# gunicorn share the same page-cache pages instead of each holding a parsed copy.
+#
+# A build holds an exclusive lock on the artifact (a `.lock` file next to the arrays)
+# while it writes the CSV and the arrays, and loading holds a shared one, so a worker
+# reloading the data (see reload.py) never pairs arrays of two different builds.
+
+def dataset_version(path):
+    # short content hash of `concatenated.csv`; versions the artifact and every cache derived from the data
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def write_artifact(concatenated, allergens, directory, version, years=None, cube=None, raw=None, raw_cube=None,
+                   history=None):
+    os.makedirs(directory, exist_ok=True)
+
+    entity = pd.Categorical(concatenated['Entity'])
+    continent = pd.Categorical(concatenated['Continent'])
+    codes = concatenated['Code'].astype(str)
+    population = pd.to_numeric(concatenated['Population'].astype(str).str.replace(',', ''), errors='coerce')
+
+    arrays = {
+        'allergens.npy': np.ascontiguousarray(concatenated[list(allergens)].to_numpy(dtype=np.float32)),
+        'codes.npy': codes.to_numpy(dtype=f'U{codes.str.len().max()}'),
+        'entity.npy': entity.codes.astype(np.int16),
+        'continent.npy': continent.codes.astype(np.int8),
+        'population.npy': population.to_numpy(dtype=np.float64),
+    }
+    if cube is not None:
+        arrays['years.npy'] = np.asarray(years, dtype=np.int16)
+        arrays['cube.npy'] = np.ascontiguousarray(cube, dtype=np.float32)
+    if raw is not None:
+        arrays['raw.npy'] = np.ascontiguousarray(raw, dtype=np.float32)
+    if raw_cube is not None:
+        arrays['raw_cube.npy'] = np.ascontiguousarray(raw_cube, dtype=np.float32)
+    if history is not None:
+        arrays['history.npy'] = np.ascontiguousarray(history, dtype=np.float32)
+    meta = {
+        'version': version,
+        'allergens': list(allergens),
+        'entities': list(entity.categories),
+        'continents': list(continent.categories),
+    }
+
+    # every file is replaced atomically; meta.json goes last so a reader never pairs it with older arrays
+    for name, values in arrays.items():
+        temporary_path = os.path.join(directory, name + '.tmp')
+        with open(temporary_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(temporary_path, os.path.join(directory, name))
+
+    temporary_path = os.path.join(directory, 'meta.json.tmp')
+    with open(temporary_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temporary_path, os.path.join(directory, 'meta.json'))
+
+
+@contextmanager
+def artifact_lock(directory, shared=True):
+    if fcntl is None:
+        yield
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        f = open(os.path.join(directory, '.lock'), 'a')
+    except OSError:
+        # a read-only data folder is never rebuilt in place
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def artifact_version(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)['version']
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def read_artifact(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(directory, name), mmap_mode='r')
+
+    frame = pd.DataFrame({
+        'Code': load('codes.npy'),
+        'Entity': pd.Categorical.from_codes(load('entity.npy'), meta['entities']),
+    })
+    frame['Continent'] = pd.Categorical.from_codes(load('continent.npy'), meta['continents'])
+    frame['Population'] = load('population.npy')
+    return frame, load('allergens.npy'), meta
+
+
+def read_cube(directory):
+    # (years, cube), or (None, None) for artifacts written without a time series
+    if not os.path.exists(os.path.join(directory, 'cube.npy')):
+        return None, None
+    return (np.load(os.path.join(directory, 'years.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'cube.npy'), mmap_mode='r'))
+
+
+def read_raw(directory):
+    # (raw, raw_cube), None for the ones the artifact was written without
+    def load(name):
+        path = os.path.join(directory, name)
+        return np.load(path, mmap_mode='r') if os.path.exists(path) else None
+
+    return load('raw.npy'), load('raw_cube.npy')
+
+
+def read_history(directory):
+    # the country-major history, None for artifacts written without it
+    path = os.path.join(directory, 'history.npy')
+    return np.load(path, mmap_mode='r') if os.path.exists(path) else None
@@ -0,0 +1,274 @@
+// Clientside callbacks of AllerVis (see clientside.py).
+//
+// Both functions rebuild the same figures as the server-side callbacks from the
+// allergen matrix kept in the `allergen_store` dcc.Store.
+
+function aggregate(store, selectedAllergens) {
+    var selected = (selectedAllergens || []).slice().sort();
+    var columns = selected.map(function (allergen) {
+        return store.allergens.indexOf(allergen);
+    }).filter(function (j) {
+        return j >= 0;
+    });
+
+    var n = store.values.length;
+    var sums = new Array(n), most = new Array(n), least = new Array(n);
+    for (var i = 0; i < n; i++) {
+        var row = store.values[i];
+        var sum = 0, max = -Infinity, min = Infinity, argmax = null, argmin = null;
+        for (var k = 0; k < columns.length; k++) {
+            var value = row[columns[k]];
+            sum += value;
+            // strict comparisons: ties go to the first allergen in alphabetical order
+            if (value > max) { max = value; argmax = store.allergens[columns[k]]; }
+            if (value < min) { min = value; argmin = store.allergens[columns[k]]; }
+        }
+        sums[i] = sum;
+        most[i] = argmax;
+        least[i] = argmin;
+    }
+    return {selected: selected, columns: columns, sums: sums, most: most, least: least};
+}
+
+function pick(values, positions) {
+    return positions.map(function (i) {
+        return values[i];
+    });
+}
+
+function mapFigure(store, selectedAllergens, selectedRegion, mapIdiom, colorScheme) {
+    var aggregation = aggregate(store, selectedAllergens);
+    var region = store.regions[selectedRegion] || store.regions.world;
+    var bubble = mapIdiom === 'bubble';
+    var all = store.codes.map(function (_, i) {
+        return i;
+    });
+
+    // some strategies (z-scores) give negative values: bubbles grow from the smallest value instead of zero,
+    // and the hover of the discrete schemes shows the values from `text` (as figures.geo_traces does)
+    var lowest = Math.min.apply(null, aggregation.sums.concat([0]));
+    var shifted = bubble && lowest < 0;
+    var sizes = shifted ? aggregation.sums.map(function (value) {
+        return value - lowest;
+    }) : aggregation.sums;
+    var sizeref = Math.max.apply(null, sizes.concat([0])) / (20 * 20);
+    var data = [];
+    var layout = {
+        template: store.template,
+        height: 340,
+        margin: bubble ? {l: 5, r: 5, b: 0, t: 0, pad: 4} : {l: 10, r: 10, b: 0, t: 0, pad: 4},
+        legend: bubble ? {tracegroupgap: 0, itemsizing: 'constant'} : {tracegroupgap: 0},
+        geo: Object.assign({
+            domain: {x: [0.0, 1.0], y: [0.0, 1.0]},
+            scope: region.scope,
+            landcolor: 'lightgray',
+            showland: true,
+            showcountries: true,
+            countrycolor: 'gray',
+            countrywidth: 0.5,
+            projection: {type: 'natural earth'}
+        }, !bubble && region.scope === 'world' ? {visible: false} : {})
+    };
+    if (region.geo.center) {
+        layout.geo.center = region.geo.center;
+    }
+    if (region.geo.projection) {
+        layout.geo.projection = Object.assign({}, layout.geo.projection, region.geo.projection);
+    }
+
+    if (colorScheme === 'sequential') {
+        layout.coloraxis = {colorbar: {title: {text: 'Prevalence'}}, colorscale: store.colorscale};
+        if (bubble) {
+            data.push({
+                type: 'scattergeo', geo: 'geo', mode: 'markers', name: '', legendgroup: '', showlegend: false,
+                locations: store.codes, hovertext: store.entities,
+                marker: {color: aggregation.sums, coloraxis: 'coloraxis', size: sizes,
+                         sizemode: 'area', sizeref: sizeref, symbol: 'circle'},
+                hovertemplate: '<b>%{hovertext}</b><br><br>Prevalence=%{marker.color}<br>Code=%{location}' +
+                               '<extra></extra>'
+            });
+        } else {
+            data.push({
+                type: 'choropleth', geo: 'geo', name: '', coloraxis: 'coloraxis',
+                locations: store.codes, hovertext: store.entities, z: aggregation.sums,
+                hovertemplate: '<b>%{hovertext}</b><br><br>Code=%{location}<br>Prevalence=%{z}<extra></extra>'
+            });
+        }
+        return {data: data, layout: layout};
+    }
+
+    var title = colorScheme === 'lpa' ? 'Least Prevalent Allergen' : 'Most Prevalent Allergen';
+    var categories = colorScheme === 'lpa' ? aggregation.least : aggregation.most;
+    layout.legend.title = {text: title};
+
+    var names = categories.filter(function (name, i) {
+        return categories.indexOf(name) === i;
+    }).sort();
+    names.forEach(function (name, c) {
+        var positions = all.filter(function (i) {
+            return categories[i] === name;
+        });
+        var color = store.colors[c % store.colors.length];
+        var trace = {
+            geo: 'geo', name: name, showlegend: true,
+            locations: pick(store.codes, positions), hovertext: pick(store.entities, positions)
+        };
+        if (bubble) {
+            Object.assign(trace, {
+                type: 'scattergeo', mode: 'markers', legendgroup: name,
+                marker: {color: color, size: pick(sizes, positions),
+                         sizemode: 'area', sizeref: sizeref, symbol: 'circle'},
+                hovertemplate: '<b>%{hovertext}</b><br><br>' + title + '=' + name +
+                    '<br>Prevalence=' + (shifted ? '%{text}' : '%{marker.size}') +
+                    '<br>Code=%{location}<extra></extra>'
+            });
+            if (shifted) {
+                trace.text = pick(aggregation.sums, positions);
+            }
+        } else {
+            Object.assign(trace, {
+                type: 'choropleth', showscale: false, colorscale: [[0.0, color], [1.0, color]],
+                z: positions.map(function () {
+                    return 1;
+                }),
+                hovertemplate: '<b>%{hovertext}</b><br><br>' + title + '=' + name +
+                    '<br>Code=%{location}<extra></extra>'
+            });
+        }
+        data.push(trace);
+    });
+    return {data: data, layout: layout};
+}
+
+function barchartFigure(store, selectedAllergens, selectedRegion) {
+    var aggregation = aggregate(store, selectedAllergens);
+    var region = store.regions[selectedRegion] || store.regions.world;
+
+    // the region's rows, ascending by aggregated prevalence (stable, like the server)
+    var order = region.positions.slice().sort(function (a, b) {
+        return aggregation.sums[a] - aggregation.sums[b] || a - b;
+    });
+    var entities = pick(store.entities, order);
+
+    var data = aggregation.selected.map(function (allergen, c) {
+        var j = store.allergens.indexOf(allergen);
+        return {
+            type: 'bar', name: allergen, legendgroup: allergen, offsetgroup: allergen, alignmentgroup: 'True',
+            orientation: 'v', showlegend: true, textposition: 'auto', xaxis: 'x', yaxis: 'y',
+            marker: {color: store.colors[c % store.colors.length]},
+            x: entities,
+            y: order.map(function (i) {
+                return store.values[i][j];
+            }),
+            hovertemplate: 'Allergen=' + allergen + '<br>Country=%{x}<br>value=%{y}<extra></extra>'
+        };
+    });
+
+    return {
+        data: data,
+        layout: {
+            template: store.template,
+            barmode: 'relative',
+            height: 400,
+            title: {text: 'Aggregated Prevalence'},
+            legend: {orientation: 'h', yanchor: 'bottom', y: 1.02, xanchor: 'right', x: 1,
+                     title: {text: 'Allergen'}, tracegroupgap: 0},
+            margin: {l: 10, r: 10, b: 20, t: 20, pad: 4},
+            xaxis: {anchor: 'y', domain: [0.0, 1.0], showticklabels: !region.world, title: {}},
+            yaxis: {anchor: 'x', domain: [0.0, 1.0], title: {}}
+        }
+    };
+}
+
+function setPath(trace, path, value) {
+    // copies the nested objects on the way, the figure of the previous render is left untouched
+    var parts = path.split('.');
+    var target = trace;
+    for (var i = 0; i < parts.length - 1; i++) {
+        target[parts[i]] = Object.assign({}, target[parts[i]]);
+        target = target[parts[i]];
+    }
+    target[parts[parts.length - 1]] = value;
+}
+
+function applyPatch(patch, figure) {
+    // see figure_patch.py
+    if (patch.kind === 'full') {
+        return patch.figure;
+    }
+    var data;
+    if (patch.kind === 'restyle') {
+        data = figure.data.map(function (trace, i) {
+            var restyled = Object.assign({}, trace);
+            Object.keys(patch.restyle[i]).forEach(function (path) {
+                var value = patch.restyle[i][path];
+                if (value === null) {
+                    // a property the new figure does not have (top-level, see figure_patch.cleared_paths)
+                    delete restyled[path];
+                } else {
+                    setPath(restyled, path, value);
+                }
+            });
+            return restyled;
+        });
+    } else {
+        data = patch.data.map(function (trace) {
+            return Object.assign({}, patch.shared, trace);
+        });
+    }
+    return Object.assign({}, figure, {data: data});
+}
+
+function sameKey(a, b) {
+    return JSON.stringify(a) === JSON.stringify(b);
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    allervis: {
+        update_map: function (store, selectedAllergens, selectedRegion, mapIdiom, colorScheme) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            return mapFigure(store, selectedAllergens, selectedRegion, mapIdiom, colorScheme);
+        },
+        update_barchart: function (store, selectedAllergens, selectedRegion) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            return barchartFigure(store, selectedAllergens, selectedRegion);
+        },
+        request_country: function (clickData, nClicks, selectedAllergens, selectedRegion, yearMode, year,
+                                   imputation, scaling, request) {
+            // the drill-down asked of the server (see allervis.py), null to close the panel; changes of the
+            // controls only reach the server while the panel is open
+            var triggered = (window.dash_clientside.callback_context.triggered || []).map(function (trigger) {
+                return trigger.prop_id;
+            });
+            if (triggered.indexOf('country_close.n_clicks') >= 0) {
+                return request ? null : window.dash_clientside.no_update;
+            }
+            var code = request ? request.code : null;
+            if (triggered.indexOf('map_graph.clickData') >= 0) {
+                // choropleth, bubble and animated maps all carry the ISO code in `location`
+                var points = (clickData && clickData.points) || [];
+                code = points.length ? points[0].location : null;
+            }
+            if (!code) {
+                return window.dash_clientside.no_update;
+            }
+            return {code: code, allergens: selectedAllergens || [], region: selectedRegion, year_mode: yearMode,
+                    year: year, imputation: imputation, scaling: scaling};
+        },
+        apply_patch: function (patch, figure, key) {
+            var noUpdate = window.dash_clientside.no_update;
+            if (!patch) {
+                return [noUpdate, noUpdate];
+            }
+            if (patch.kind !== 'full' && !(figure && sameKey(patch.key, key))) {
+                // the patch belongs to another layout than the one shown
+                return [noUpdate, noUpdate];
+            }
+            return [applyPatch(patch, figure), patch.key];
+        }
+    }
+});
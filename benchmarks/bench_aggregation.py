@@ -0,0 +1,70 @@
+"""Micro-benchmark: per-callback aggregation latency, row-wise `apply` vs `AllergenMatrix`.
+
+Run from the repository root:
+
+    python benchmarks/bench_aggregation.py
+"""
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregation import AllergenMatrix  # noqa: E402
+
+data_path = 'Food Allergies Data'
+repeats = 20
+
+
+def apply_barchart(frame, selected_allergens):
+    return frame.apply(lambda row: row[selected_allergens].sum(), axis=1)
+
+
+def apply_map(frame, selected_allergens):
+    selected_set = frame.apply(lambda row: row[selected_allergens].sum(), axis=1)
+    most_prevalent_allergen = frame.apply(
+        lambda row: row[selected_allergens][row[selected_allergens] == row[selected_allergens].max()].index[0],
+        axis=1)
+    least_prevalent_allergen = frame.apply(
+        lambda row: row[selected_allergens][row[selected_allergens] == row[selected_allergens].min()].index[0],
+        axis=1)
+    return selected_set, most_prevalent_allergen, least_prevalent_allergen
+
+
+def best_of(function, *args):
+    return min(timeit.repeat(lambda: function(*args), number=1, repeat=repeats)) * 1000
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    frame = pd.read_csv(os.path.join(root, data_path, 'concatenated.csv'))
+    list_of_allergens = sorted(frame.columns[2:21])
+    matrix = AllergenMatrix.from_frame(frame, list_of_allergens)
+
+    subsets = {
+        'common': sorted(['Milk', 'Egg', 'Seafood', 'Peanut', 'Wheat']),
+        'all': list_of_allergens,
+        'single': ['Wheat'],
+    }
+
+    print(f'{"subset":<8} {"callback":<10} {"apply (ms)":>12} {"matrix (ms)":>12} {"speedup":>9}')
+    for name, selected_allergens in subsets.items():
+        selected_set, most_prevalent, least_prevalent = apply_map(frame, selected_allergens)
+        aggregation = matrix.aggregate(selected_allergens)
+        assert np.allclose(selected_set.to_numpy(), aggregation.selected_set)
+        assert (most_prevalent.to_numpy() == aggregation.most_prevalent_allergen).all()
+        assert (least_prevalent.to_numpy() == aggregation.least_prevalent_allergen).all()
+
+        for callback, legacy, vectorized in (('barchart', apply_barchart, matrix.selected_set),
+                                             ('map', apply_map, matrix.aggregate)):
+            legacy_ms = best_of(legacy, frame, selected_allergens)
+            vectorized_ms = best_of(vectorized, selected_allergens)
+            print(f'{name:<8} {callback:<10} {legacy_ms:>12.3f} {vectorized_ms:>12.3f} '
+                  f'{legacy_ms / vectorized_ms:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Cold-start benchmark: loading the dataset from `concatenated.csv` vs the memory-mapped binary artifact.
+
+Every measurement runs in a fresh interpreter (pandas and numpy already imported), and reports
+the load time, the RSS growth caused by the load, and how much of the worker's memory is
+private to it (the part forked gunicorn workers cannot share).
+
+    python benchmarks/bench_cold_start.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+probe = r'''
+import json, mmap, sys, time
+sys.path.insert(0, {root!r})
+import numpy as np, pandas as pd
+from sources import data_path, allergen_paths
+from snapshot import DatasetSnapshot
+
+
+def memory():
+    fields = {{}}
+    for name in ('/proc/self/status', '/proc/self/smaps_rollup'):
+        try:
+            with open(name) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if value.strip().endswith('kB'):
+                        fields[key] = int(value.split()[0])
+        except FileNotFoundError:
+            pass
+    return fields.get('VmRSS', 0), fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+
+
+allergens = sorted(allergen_paths)
+rss_before, private_before = memory()
+start = time.perf_counter()
+if {mode!r} == 'csv':
+    dataset = DatasetSnapshot.read_csv(data_path + '//concatenated.csv', allergens)
+else:
+    dataset = DatasetSnapshot.load(data_path, allergens)
+dataset.matrix.aggregate(allergens)
+elapsed = time.perf_counter() - start
+rss_after, private_after = memory()
+
+buffer = dataset.matrix.values
+while buffer is not None and not isinstance(buffer, mmap.mmap):
+    buffer = getattr(buffer, 'base', None)
+print(json.dumps({{'ms': elapsed * 1000, 'rss_kb': rss_after - rss_before,
+                  'private_kb': private_after - private_before,
+                  'mapped': buffer is not None}}))
+'''
+
+
+def measure(mode, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', probe.format(root=root, mode=mode)], cwd=root,
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"source":<10} {"load (ms)":>10} {"RSS (kB)":>10} {"private (kB)":>13} {"mmap":>6}')
+    for mode in ('csv', 'artifact'):
+        results = measure(mode, args.runs)
+        print(f'{mode:<10} {statistics.median(r["ms"] for r in results):>10.2f} '
+              f'{statistics.median(r["rss_kb"] for r in results):>10.0f} '
+              f'{statistics.median(r["private_kb"] for r in results):>13.0f} '
+              f'{str(results[0]["mapped"]):>6}')
+
+
+if __name__ == '__main__':
+    main()
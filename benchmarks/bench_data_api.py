@@ -0,0 +1,55 @@
+"""Data API benchmark: `/api/prevalence` (see `data_api.py`) vs scraping the bar-chart figure.
+
+For every allergen of the dataset over the whole world, reports the response size and the
+median time of each output format, next to the bar-chart callback that downstream users
+used to scrape for the same ranking (figures are built fresh, the figure cache is cleared
+before every request).
+
+    python benchmarks/bench_data_api.py [--repeat 10]
+"""
+import argparse
+import statistics
+import time
+
+from dash_client import load_app, post_callback, barchart_inputs
+
+
+def median_ms(request, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = request()
+        times.append(time.perf_counter() - start)
+    return len(body), statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    client = allervis.server.test_client()
+    allergens = allervis.list_of_allergens
+
+    print(f'{"source":<34} {"bytes":>9} {"ms":>8}')
+
+    def scrape():
+        allervis.figure_cache.clear()
+        return post_callback(client, 'stack_barchart_graph.figure', barchart_inputs(allergens, 'world'))
+
+    size, ms = median_ms(scrape, args.repeat)
+    print(f'{"bar-chart figure (scraped)":<34} {size:>9} {ms:>8.2f}')
+
+    formats = ['csv', 'ndjson'] + (['arrow'] if allervis.data_api.arrow_available() else [])
+    for data_format in formats:
+        url = f'/api/prevalence.{data_format}?allergens={",".join(allergens)}&region=world'
+        size, ms = median_ms(lambda: client.get(url).get_data(), args.repeat)
+        print(f'{"/api/prevalence." + data_format:<34} {size:>9} {ms:>8.2f}')
+
+    size, ms = median_ms(lambda: client.get('/api/prevalence.csv?top=10').get_data(), args.repeat)
+    print(f'{"/api/prevalence.csv?top=10":<34} {size:>9} {ms:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Country drill-down benchmark: the history of a country from the store against scanning the CSVs.
+
+For a sample of countries, times reading their history three ways: scanning every source CSV
+(what a drill-down without the store would do), scanning the long `history.csv` of the build
+stage, and looking it up in the store of `history_store.py`, both cold (its cache cleared) and
+cached. Then clicks the countries on the map through the Dash test client and reports the
+latency of the drill-down callback, with the figure cache cleared before every click (cold) and
+not (warm). Exits with an error when the cold p95 is over `--budget-ms`.
+
+    python benchmarks/bench_drilldown.py [--countries 40] [--region europe] [--budget-ms 50]
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from dash_client import load_app
+
+country_output = '..country_graph.figure...country_area.style..'
+
+
+def percentile(seconds, q):
+    return float(np.percentile(seconds, q)) * 1000
+
+
+def timed(function, codes):
+    seconds = []
+    for code in codes:
+        start = time.perf_counter()
+        function(code)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def click_payload(code, allergens, region):
+    # what `request_country` of assets/allervis.js asks for when the country is clicked
+    request = {'code': code, 'allergens': list(allergens), 'region': region, 'year_mode': 'latest', 'year': None,
+               'imputation': 'median', 'scaling': 'max'}
+    return {
+        'output': country_output,
+        'outputs': [{'id': 'country_graph', 'property': 'figure'}, {'id': 'country_area', 'property': 'style'}],
+        'inputs': [{'id': 'country_request', 'property': 'data', 'value': request}],
+        'changedPropIds': ['country_request.data'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--countries', type=int, default=40)
+    parser.add_argument('--region', default='europe')
+    parser.add_argument('--budget-ms', type=float, default=50.0)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    import preprocessing
+    from sources import allergen_paths
+
+    dataset = allervis.dataset
+    if dataset.history is None:
+        sys.exit('The artifact has no history.npy: run `python preprocessing.py --force` first')
+    store = dataset.history
+    codes = list(dataset.codes[np.linspace(0, len(dataset) - 1, min(args.countries, len(dataset))).astype(int)])
+    allergens = allervis.list_of_common_allergens
+
+    def scan_sources(code):
+        return {allergen: frame[frame['Code'] == code]
+                for allergen, frame in ((allergen, pd.read_csv(path)) for allergen, path in allergen_paths.items())}
+
+    def scan_history(code):
+        history = pd.read_csv(preprocessing.paths.history)
+        return history[history['Code'] == code]
+
+    def cold_lookup(code):
+        store.lookup.cache_clear()
+        return store.series(code, allergens)
+
+    rows = {'scan source CSVs': timed(scan_sources, codes[:5]),
+            'scan history.csv': timed(scan_history, codes[:5]),
+            'store, cold': timed(cold_lookup, codes)}
+    timed(lambda code: store.series(code, allergens), codes)
+    rows['store, cached'] = timed(lambda code: store.series(code, allergens), codes)
+
+    client = allervis.server.test_client()
+
+    def click(code):
+        response = client.post('/_dash-update-component', data=json.dumps(click_payload(code, allergens, args.region)),
+                               content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(f'the drill-down of {code} returned HTTP {response.status_code}')
+        return response
+
+    def cold_click(code):
+        allervis.figure_cache.clear()
+        return click(code)
+
+    click(codes[0])
+    rows['callback, cold'] = timed(cold_click, codes)
+    rows['callback, warm'] = timed(click, codes)
+
+    print(f'{len(codes)} countries, {len(allergens)} allergens, {len(store.years)} years; region {args.region}\n')
+    print(f'{"":<18} {"p50 (ms)":>10} {"p95 (ms)":>10} {"mean (ms)":>10}')
+    for name, seconds in rows.items():
+        print(f'{name:<18} {percentile(seconds, 50):>10.3f} {percentile(seconds, 95):>10.3f} '
+              f'{statistics.mean(seconds) * 1000:>10.3f}')
+
+    p95 = percentile(rows['callback, cold'], 95)
+    if p95 > args.budget_ms:
+        print(f'\nover budget: cold callback p95 {p95:.1f} ms > {args.budget_ms:.0f} ms')
+        sys.exit(1)
+    print(f'\nwithin budget: cold callback p95 {p95:.1f} ms <= {args.budget_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
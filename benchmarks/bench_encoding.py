@@ -0,0 +1,81 @@
+"""Encoding benchmark: the bytes of every figure callback output under each encoding of `encoding.py`.
+
+For the map (both idioms, every color scheme) and the bar chart, with every allergen selected,
+builds the figure under three encodings of its values: full precision (as before), rounded to
+`--decimals` decimals, and rounded and sent as typed arrays. Each figure is serialized into a
+callback response the way Dash does it, then compressed with gzip (level 6, what Dash used
+alone) and Brotli (level 5). Reports the bytes of each, the time to serialize and compress the
+response, and the saving of the rounded, Brotli-compressed response over the full-precision,
+gzip-compressed one.
+
+    python benchmarks/bench_encoding.py [--region world] [--decimals 4] [--repeat 5]
+"""
+import argparse
+import gzip
+import json
+import statistics
+import time
+
+import brotli
+import plotly
+
+from dash_client import load_app
+
+encodings = {'full': (None, False), 'rounded': ('decimals', False), 'typed': ('decimals', True)}
+
+
+def response_body(output, figure):
+    # the body of `/_dash-update-component`, as Dash serializes it
+    component_id, component_property = output.split('.')
+    return json.dumps({'response': {component_id: {component_property: figure}}, 'multi': True},
+                      cls=plotly.utils.PlotlyJSONEncoder).encode()
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', default='world')
+    parser.add_argument('--decimals', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    dataset, figures = allervis.dataset, allervis.figures
+    allergens, region = allervis.list_of_allergens, allervis.dataset.regions.get(args.region)
+    cases = {'barchart': ('stack_barchart_graph.figure',
+                          lambda decimals, typed: figures.barchart(dataset, allergens, region, None, None,
+                                                                   decimals, typed))}
+    for idiom in ('choropleth', 'bubble'):
+        for scheme in ('sequential', 'mpa', 'lpa'):
+            cases[f'{idiom} {scheme}'] = ('map_graph.figure',
+                                          lambda decimals, typed, idiom=idiom, scheme=scheme: figures.geo_map(
+                                              dataset, allergens, region, idiom, scheme, None, None, 3,
+                                              decimals, typed))
+
+    print(f'{"figure":<22} {"encoding":<8} {"json (B)":>9} {"gzip (B)":>9} {"br (B)":>8} '
+          f'{"json (ms)":>10} {"gzip (ms)":>10} {"br (ms)":>8}')
+    for name, (output, build) in cases.items():
+        sizes = {}
+        for encoding, (decimals, typed) in encodings.items():
+            figure = build(args.decimals if decimals else None, typed)
+            body, json_ms = timed(lambda: response_body(output, figure), args.repeat)
+            gzipped, gzip_ms = timed(lambda: gzip.compress(body, 6), args.repeat)
+            compressed, br_ms = timed(lambda: brotli.compress(body, quality=5), args.repeat)
+            sizes[encoding] = (len(body), len(gzipped), len(compressed))
+            print(f'{name:<22} {encoding:<8} {len(body):>9} {len(gzipped):>9} {len(compressed):>8} '
+                  f'{json_ms:>10.2f} {gzip_ms:>10.2f} {br_ms:>8.2f}')
+        before, after = sizes['full'][1], sizes['rounded'][2]
+        print(f'{"":<22} {"saving":<8} {before} B (full, gzip) -> {after} B (rounded, br): '
+              f'{100 * (1 - after / before):.0f}% smaller')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Export benchmark: PNG/SVG snapshots served by `/export` (see `export.py`), requires `kaleido`.
+
+Fires bursts of identical concurrent requests and checks that each burst is rendered only
+once and that every request receives the same image; then reports the latency of a render,
+of a cached image and of a conditional request answered with 304.
+
+    python benchmarks/bench_export.py [--threads 16]
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dash_client import load_app
+
+urls = ['/export/map.png?allergens=Milk,Egg&region=europe&idiom=bubble&scheme=mpa',
+        '/export/map.svg?allergens=Wheat&region=world&scheme=sequential',
+        '/export/barchart.png?allergens=Milk,Egg,Peanut&region=asia&width=900&height=400',
+        '/export/barchart.svg?region=oceania&year=1990']
+
+
+def timed_get(allervis, url, headers=None):
+    start = time.perf_counter()
+    response = allervis.server.test_client().get(url, headers=headers or {})
+    return response, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    if not allervis.export.kaleido_available():
+        print('kaleido is not installed')
+        return 1
+    # start the worker processes (and their renderers) before measuring
+    timed_get(allervis, '/export/barchart.png?allergens=Rye')
+
+    failures = 0
+    print(f'{"url":<80} {"render (ms)":>12} {"cached (ms)":>12} {"304 (ms)":>9} {"renders":>8}')
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for url in urls:
+            renders = allervis.export_pool.renders
+            start = time.perf_counter()
+            responses = list(pool.map(lambda _: timed_get(allervis, url)[0], range(args.threads)))
+            render_ms = (time.perf_counter() - start) * 1000
+            renders = allervis.export_pool.renders - renders
+            bodies = {response.get_data() for response in responses}
+            if renders != 1 or len(bodies) != 1 or any(response.status_code != 200 for response in responses):
+                failures += 1
+
+            cached_ms = statistics.median(timed_get(allervis, url)[1] for _ in range(20))
+            etag = responses[0].headers['ETag']
+            not_modified, not_modified_ms = timed_get(allervis, url, {'If-None-Match': etag})
+            if not_modified.status_code != 304:
+                failures += 1
+            print(f'{url:<80} {render_ms:>12.1f} {cached_ms:>12.2f} {not_modified_ms:>9.2f} {renders:>8}')
+
+    allervis.export_pool.shutdown()
+    print(f'{len(urls)} bursts of {args.threads} requests, {failures} failures')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Figure benchmark: the `graph_objects` builders of `figures.py` vs the Plotly Express builders.
+
+First checks that both builders draw the same figures (golden comparison) for every region,
+map idiom and color scheme, and for several allergen selections and years: same traces with
+the same properties and the same points, and the same layout. Plotly Express sorts the table
+by category with an unstable sort, so points are compared as sets within each trace. Then
+reports the median build time per figure (building the figure and serializing it to the
+JSON that is cached and sent to the browser).
+
+    python benchmarks/bench_figures.py [--repeat 5]
+"""
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import os
+import time
+
+# compared at full precision: Plotly Express does not round the values (see encoding.py)
+os.environ['ALLERVIS_FIGURE_DECIMALS'] = ''
+
+from dash_client import load_app  # noqa: E402
+from figure_cache import figure_to_json  # noqa: E402
+
+
+def canonical(figure):
+    traces = []
+    for trace in figure['data']:
+        trace = dict(trace)
+        marker = dict(trace.pop('marker', {}))
+        keys = trace.pop('locations', None) or trace.pop('x', None) or []
+        columns = [trace.pop('hovertext', None), trace.pop('y', None), trace.pop('z', None),
+                   marker.pop('size', None), marker.pop('color') if isinstance(marker.get('color'), list) else None]
+        points = list(zip(keys, *[column if column is not None else [None] * len(keys) for column in columns]))
+        if trace['type'] != 'bar':
+            points.sort(key=str)
+        traces.append((json.dumps(trace, sort_keys=True), json.dumps(marker, sort_keys=True), points))
+    return traces, json.dumps(figure['layout'], sort_keys=True)
+
+
+def cases(allervis):
+    selections = [allervis.list_of_common_allergens, allervis.list_of_allergens, ['Wheat', 'Rye', 'Oat'], ['Milk']]
+    years = [None] + allervis.dataset.years[::20]
+    regions = [option['value'] for option in allervis.dataset.regions.options()]
+    for allergens, year, region in itertools.product(selections, years, regions):
+        yield 'barchart', (allergens, region, year)
+        for idiom, scheme in itertools.product(['choropleth', 'bubble'], ['sequential', 'mpa', 'lpa']):
+            yield 'map', (allergens, region, idiom, scheme, year)
+
+
+def timed(build, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        figure = figure_to_json(build())
+        times.append(time.perf_counter() - start)
+    return figure, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    builders = {'barchart': (allervis.build_barchart_express, allervis.build_barchart),
+                'map': (allervis.build_map_express, allervis.build_map)}
+
+    mismatches = 0
+    times = {}
+    for kind, params in cases(allervis):
+        express, direct = builders[kind]
+        expected, express_ms = timed(lambda: express(*params), args.repeat)
+        figure, direct_ms = timed(lambda: direct(*params), args.repeat)
+        if canonical(figure) != canonical(expected):
+            mismatches += 1
+            if mismatches <= 10:
+                print('  mismatch:', kind, params)
+        name = kind if kind == 'barchart' else f'{params[2]} {params[3]}'
+        times.setdefault(name, []).append((express_ms, direct_ms))
+
+    print(f'{"figure":<22} {"express (ms)":>13} {"graph_objects (ms)":>19} {"speedup":>8}')
+    for name, pairs in times.items():
+        express_ms = statistics.median(pair[0] for pair in pairs)
+        direct_ms = statistics.median(pair[1] for pair in pairs)
+        print(f'{name:<22} {express_ms:>13.2f} {direct_ms:>19.2f} {express_ms / direct_ms:>7.1f}x')
+    print(f'{sum(len(pairs) for pairs in times.values())} figures compared, {mismatches} differ')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Metrics overhead benchmark: what the instrumentation of `metrics.py` adds to a callback.
+
+Reports the cost of timing one callback with the stages the map callback records, next to
+the median latency of the map callback itself, answered from the figure cache (the fastest
+and most common case, where the overhead weighs the most) and built fresh. Also reports the
+time to render `/metrics`.
+
+    python benchmarks/bench_metrics.py [--repeat 2000]
+"""
+import argparse
+import statistics
+import time
+
+from dash_client import load_app, post_callback, map_inputs
+
+
+def instrumentation_us(metrics, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with metrics.callback('bench', 'europe/bubble/mpa/latest'):
+            for name in ('aggregation', 'filtering', 'build', 'serialization'):
+                with metrics.stage(name):
+                    pass
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def median_us(request, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        request()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    client = allervis.server.test_client()
+    inputs = map_inputs(allervis.list_of_common_allergens, 'europe', 'bubble', 'mpa')
+
+    overhead = instrumentation_us(allervis.metrics, args.repeat)
+    cached = median_us(lambda: post_callback(client, 'map_graph.figure', inputs), args.repeat)
+
+    def fresh():
+        allervis.figure_cache.clear()
+        post_callback(client, 'map_graph.figure', inputs)
+
+    built = median_us(fresh, max(args.repeat // 20, 10))
+    scrape = median_us(lambda: client.get('/metrics').get_data(), max(args.repeat // 20, 10))
+
+    print(f'{"":<34} {"us":>10} {"overhead":>9}')
+    print(f'{"callback + 4 stages, timed":<34} {overhead:>10.1f}')
+    print(f'{"map callback, cached":<34} {cached:>10.1f} {overhead / cached:>9.2%}')
+    print(f'{"map callback, built":<34} {built:>10.1f} {overhead / built:>9.2%}')
+    print(f'{"GET /metrics":<34} {scrape:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Payload benchmark: full figures vs patches (see `figure_patch.py`) when one allergen is toggled.
+
+Starting from the "Common" preset, every other allergen is added and removed again, one
+request per change, as a user clicking through the dropdown. Each change is sent twice
+through the Flask test client: without the key of a figure in the browser (the server answers
+with the whole figure, as before patch mode) and with it (the server answers with a patch).
+Figures are cached beforehand, so the times are those of the callback, the serialization
+and the response.
+
+    python benchmarks/bench_payload.py [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ['ALLERVIS_PATCH_UPDATES'] = '1'
+
+from dash_client import load_app, post_callback, figure_of, map_inputs, barchart_inputs  # noqa: E402
+
+
+def toggles(allervis):
+    selected = list(allervis.list_of_common_allergens)
+    for allergen in allervis.list_of_allergens:
+        if allergen not in selected:
+            yield selected + [allergen]
+            yield selected
+
+
+def measure(client, output, inputs, key, repeat):
+    state = [(output.split('.')[0].replace('patch', 'key') + '.data', key)]
+    post_callback(client, output, inputs, state)  # fills the figure cache
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = post_callback(client, output, inputs, state)
+        times.append(time.perf_counter() - start)
+    return len(body), statistics.median(times) * 1000, figure_of(body, output)['kind']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    client = allervis.server.test_client()
+    version = allervis.dataset.version
+    cases = [('bar chart', 'barchart_patch.data', lambda allergens: barchart_inputs(allergens, 'world'),
+              [version, 'world'])]
+    for idiom in ('choropleth', 'bubble'):
+        for scheme in ('sequential', 'mpa'):
+            cases.append((f'{idiom} {scheme}', 'map_patch.data',
+                          lambda allergens, idiom=idiom, scheme=scheme: map_inputs(allergens, 'world', idiom, scheme),
+                          [version, 'world', idiom, scheme, False]))
+
+    print(f'{"figure":<22} {"full (B)":>10} {"patch (B)":>10} {"full (ms)":>10} {"patch (ms)":>11}  patch')
+    for name, output, inputs_of, key in cases:
+        full_bytes, patch_bytes, full_ms, patch_ms = [], [], [], []
+        for allergens in toggles(allervis):
+            inputs = inputs_of(allergens)
+            size, ms, _ = measure(client, output, inputs, None, args.repeat)
+            full_bytes.append(size)
+            full_ms.append(ms)
+            size, ms, kind = measure(client, output, inputs, key, args.repeat)
+            patch_bytes.append(size)
+            patch_ms.append(ms)
+        print(f'{name:<22} {statistics.mean(full_bytes):>10.0f} {statistics.mean(patch_bytes):>10.0f} '
+              f'{statistics.mean(full_ms):>10.2f} {statistics.mean(patch_ms):>11.2f}  {kind}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""Ranking benchmark: the top allergens of every country from the precomputed rankings vs sorting.
+
+For selections of 1 to all allergens, reports the time to find the 3 most prevalent selected
+allergens of every country by sorting the selected columns on every request, and by a lookup
+of the selection mask in the per-country rankings (see `aggregation.py`), next to the batched
+argmax/argmin of `AllergenMatrix.aggregate` for reference. Both give the same allergens, ties
+included, and the first one is always the most prevalent allergen of the aggregation.
+
+    python benchmarks/bench_ranking.py [--repeat 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from sources import data_path, allergen_paths  # noqa: E402
+from snapshot import DatasetSnapshot  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    matrix = DatasetSnapshot.load(data_path, sorted(allergen_paths)).matrix
+    ranking = matrix.ranking
+    labels = np.array(matrix.allergens, dtype=object)
+
+    print(f'{"allergens":>9} {"sort (us)":>10} {"ranking (us)":>13} {"aggregate (us)":>15}')
+    for k in (1, 2, 5, 10, len(matrix.allergens)):
+        selected = matrix.allergens[:k]
+        indices = matrix.column_indices(selected)
+        mask = matrix.column_mask(selected)
+
+        def sort():
+            subset = matrix.values.take(indices, axis=1)
+            return indices[np.argsort(-subset, axis=1, kind='stable')[:, :3]]
+
+        def lookup():
+            return ranking.top(mask, 3)
+
+        assert (sort() == lookup()).all()
+        assert (labels[lookup()[:, 0]] == matrix.aggregate(selected).most_prevalent_allergen).all()
+        times = [timeit.timeit(f, number=args.repeat) / args.repeat * 1e6
+                 for f in (sort, lookup, lambda: matrix.aggregate(selected))]
+        print(f'{k:>9} {times[0]:>10.1f} {times[1]:>13.1f} {times[2]:>15.1f}')
+
+
+if __name__ == '__main__':
+    main()
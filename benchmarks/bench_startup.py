@@ -0,0 +1,55 @@
+"""Startup benchmark: what a gunicorn worker pays to import `allervis:server`.
+
+Every measurement runs in a fresh interpreter and reports the time to import the app, the
+worker's RSS afterwards, and the heavy modules (see `check_serving_imports.py`) that the app
+loads beyond its dependencies.
+
+    python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from check_serving_imports import dependencies, heavy_modules, loaded_modules
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+probe = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+
+start = time.perf_counter()
+import allervis
+elapsed = time.perf_counter() - start
+
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({{'ms': elapsed * 1000, 'rss_kb': rss, 'modules': len(sys.modules),
+                  'loaded': sorted(sys.modules)}}))
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, '-c', probe.format(root=root)], cwd=root, check=True,
+                                capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    baseline = set(loaded_modules(dependencies))
+    heavy = heavy_modules([module for module in results[0]['loaded'] if module not in baseline])
+    print(f'{"import (ms)":>12} {"RSS (MB)":>9} {"modules":>8}  heavy modules')
+    print(f'{statistics.median(r["ms"] for r in results):>12.0f} '
+          f'{statistics.median(r["rss_kb"] for r in results) / 1024:>9.1f} '
+          f'{results[0]["modules"]:>8}  {", ".join(heavy) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Checks the shared backends of the figure cache (see `figure_cache.py`) offline.
+
+Runs the same sequence against a `FileBackend` on a temporary directory and a `RedisBackend`
+on an in-process stand-in for a Redis client: figures round-trip, a figure built while a
+reload happens stays under the version it was built from, moving to a new version removes
+the entries of the old ones, the files stay under their bound (the least recently used ones
+removed first), other files of the cache directory are left alone and every Redis entry is
+written with the TTL.
+
+    python benchmarks/check_figure_cache.py
+"""
+import fnmatch
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from figure_cache import FigureCache, FileBackend, RedisBackend  # noqa: E402
+
+
+class LocalRedis:
+    # the part of the redis-py client the backend uses, keys and values kept as bytes like the real one
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, key):
+        return self.values.get(key.encode())
+
+    def set(self, key, value, ex=None):
+        self.values[key.encode()] = value.encode()
+        self.expiry[key.encode()] = ex
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.values) if fnmatch.fnmatchcase(key.decode(), match)]
+
+    def delete(self, key):
+        self.values.pop(key, None)
+        self.expiry.pop(key, None)
+
+
+def figure(i):
+    return {'data': [{'type': 'bar', 'y': [i]}], 'layout': {}}
+
+
+def check(name, backend, entries):
+    cache = FigureCache(backend, version='v1')
+    for i in range(3):
+        cache.put(('barchart', ('Milk',), i), figure(i))
+    assert cache.get(('barchart', ('Milk',), 1)) == figure(1), name
+    assert cache.get(('barchart', ('Milk',), 3)) is None, name
+
+    # a reload while a figure is being built: it stays under the version it was built from
+    def build_during_reload():
+        cache.version = 'v2'
+        return {'data': [], 'layout': {}}
+
+    cache.get_or_build(('map', ('Milk',), 'world'), build_during_reload, 'v1')
+    assert cache.get(('map', ('Milk',), 'world'), 'v1') is not None, name
+    assert cache.get(('map', ('Milk',), 'world')) is None, name
+
+    cache.put(('barchart', ('Milk',), 0), figure(0))
+    cache.set_version('v2')
+    assert entries() == 1, f'{name}: {entries()} entries left after the reload'
+    assert cache.get(('barchart', ('Milk',), 1), 'v1') is None, name
+    assert cache.get(('barchart', ('Milk',), 0)) == figure(0), name
+    cache.clear()
+    assert entries() == 0, name
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix='allervis-figure-cache-')
+    try:
+        backend = FileBackend(directory, max_entries=8)
+        # a file of someone else in the same directory
+        other = os.path.join(directory, 'settings.json')
+        with open(other, 'w') as f:
+            f.write('{}')
+        check('file', backend, lambda: len(backend))
+
+        # past the bound, the least recently used files go first
+        for i in range(8):
+            backend.store(f'v1:{i}', figure(i))
+            time.sleep(0.01)
+        backend.load('v1:0')
+        backend.store('v1:8', figure(8))
+        assert len(backend) == 8, len(backend)
+        assert backend.load('v1:0') == figure(0) and backend.load('v1:1') is None
+        assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+        backend.retain('v2')
+        backend.clear()
+        assert os.listdir(directory) == ['settings.json'], os.listdir(directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    client = LocalRedis()
+    check('redis', RedisBackend(client, ttl=3600), lambda: len(client.values))
+    RedisBackend(client, ttl=3600).store('v1:0', figure(0))
+    assert set(client.expiry.values()) == {3600}, client.expiry
+    print('ok: file and Redis backends round-trip, keep versions apart, drop old versions and stay bounded')
+
+
+if __name__ == '__main__':
+    main()
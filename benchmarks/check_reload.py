@@ -0,0 +1,141 @@
+"""Checks the hot reload of the data (see `reload.py`) offline, on a copy of the data folder.
+
+Starts a `DataWatcher` on a temporary copy while reader threads keep ranking countries on
+whatever snapshot is being served, then drops an updated Milk source file into the copy and
+waits for the swap: only Milk is parsed again, the new snapshot holds the new values and the
+other allergens unchanged, the figure cache moves to the new version and no reader fails. A
+malformed file is then dropped: the rebuild fails and the served snapshot stays the same. A
+figure whose build a reload interrupts stays cached under the version it was built from.
+Reports the time from dropping the file to serving the new snapshot.
+
+    python benchmarks/check_reload.py [--interval 0.1]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+os.chdir(root)
+
+import preprocessing  # noqa: E402
+from data_api import ranking  # noqa: E402
+from figure_cache import FigureCache  # noqa: E402
+from reload import DataWatcher  # noqa: E402
+from snapshot import DatasetSnapshot  # noqa: E402
+from sources import data_path, allergen_paths, source_files  # noqa: E402
+
+allergens = sorted(allergen_paths)
+
+
+def drop(path, frame):
+    # written next to the target and renamed over it, as a sync job would
+    temporary_path = path + '.part'
+    frame.to_csv(temporary_path, index=False)
+    os.replace(temporary_path, path)
+
+
+def wait_for(condition, timeout=120):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError('the watcher did not pick up the change')
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='allervis-reload-')
+    try:
+        data = os.path.join(directory, 'data')
+        shutil.copytree(data_path, data, ignore=shutil.ignore_patterns('.lock'))
+        preprocessing.build(directory=data)
+
+        served = {'dataset': DatasetSnapshot.load(data, allergens)}
+        cache = FigureCache(version=served['dataset'].version)
+        cache.put(('barchart', ('Milk',), 'world'), {'data': []})
+
+        def swap(snapshot):
+            served['dataset'] = snapshot
+            cache.set_version(snapshot.version)
+
+        failures = []
+        stop = threading.Event()
+
+        def read():
+            while not stop.is_set():
+                try:
+                    dataset = served['dataset']
+                    matrix, aggregation, positions = ranking(dataset, ['Milk', 'Wheat'], 'europe')
+                    assert len(positions) == len(dataset.regions.get('europe').positions)
+                except Exception as error:
+                    failures.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+
+        old = served['dataset']
+        watcher = DataWatcher(data, lambda: DatasetSnapshot.load(data, allergens), swap,
+                              version=old.version, interval=args.interval).start()
+
+        # the most recent Milk value of France, doubled
+        milk_path = f'{data}//{source_files["Milk"]}'
+        milk = pd.read_csv(milk_path)
+        last = milk.index[milk['Code'] == 'FRA'][-1]
+        milk.iloc[last, -1] *= 2
+        started = time.perf_counter()
+        drop(milk_path, milk)
+        wait_for(lambda: watcher.reloads == 1)
+        elapsed = time.perf_counter() - started
+
+        new = served['dataset']
+        france = list(new.codes).index('FRA')
+        milk_column = allergens.index('Milk')
+        others = [j for j in range(len(allergens)) if j != milk_column]
+        assert watcher.rebuilt == ['Milk'], watcher.rebuilt
+        assert new.version != old.version and cache.version == new.version
+        assert cache.get(('barchart', ('Milk',), 'world')) is None
+        assert np.isclose(new._raw[france, milk_column], 2 * old._raw[france, milk_column])
+        assert np.array_equal(np.asarray(new._raw)[:, others], np.asarray(old._raw)[:, others], equal_nan=True)
+
+        # a malformed file: the rebuild fails and the served snapshot stays
+        drop(milk_path, pd.DataFrame({'Entity': ['France'], 'Year': [2020]}))
+        wait_for(lambda: watcher.failures == 1)
+        time.sleep(5 * args.interval)
+        assert served['dataset'] is new and watcher.reloads == 1
+
+        # a reload while a figure is being built: it stays under the version it was built from
+        def build_during_reload():
+            cache.set_version('next')
+            return {'data': []}
+
+        cache.get_or_build(('map', ('Milk',), 'world'), build_during_reload, new.version)
+        assert cache.get(('map', ('Milk',), 'world')) is None
+        assert cache.get(('map', ('Milk',), 'world'), new.version) is not None
+
+        watcher.stop()
+        stop.set()
+        for reader in readers:
+            reader.join()
+        if failures:
+            print(f'{len(failures)} failed reads, e.g. {failures[0]!r}')
+            sys.exit(1)
+        print(f'ok: Milk rebuilt and swapped in {elapsed:.2f} s after the file was dropped, '
+              f'version {old.version} -> {new.version}')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
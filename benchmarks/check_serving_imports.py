@@ -0,0 +1,47 @@
+"""Fails when heavy modules are imported by the serving path, i.e. by `import allervis`.
+
+Modules that only the build stage, the optional features or the reference figure builders
+need (scikit-learn, SciPy, Plotly Express, pyarrow, Kaleido, Redis, the preprocessing stage)
+must be imported lazily, where they are used. Modules that the serving dependencies (Dash,
+Flask, pandas, Plotly) import on their own are not counted: e.g. pandas loads pyarrow
+whenever it is installed.
+
+    python benchmarks/check_serving_imports.py
+"""
+import json
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavy = ('sklearn', 'scipy', 'plotly.express', 'pyarrow', 'kaleido', 'redis', 'matplotlib', 'preprocessing')
+
+dependencies = 'import dash, dash_bootstrap_components, flask, numpy, pandas, plotly.graph_objects, plotly.io'
+
+
+def loaded_modules(statement):
+    code = f'import json, sys\nsys.path.insert(0, {root!r})\n{statement}\nprint(json.dumps(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, check=True, capture_output=True,
+                            text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def heavy_modules(modules):
+    # the heavy packages among `modules`, each reported once
+    return sorted({name for name in heavy for module in modules if module == name or module.startswith(name + '.')})
+
+
+def main():
+    baseline = set(loaded_modules(dependencies))
+    serving = [module for module in loaded_modules('import allervis') if module not in baseline]
+    found = heavy_modules(serving)
+    if found:
+        print('heavy modules imported by allervis:', ', '.join(found))
+        return 1
+    print(f'ok: allervis imports {len(serving)} modules beyond its dependencies, none of them heavy')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
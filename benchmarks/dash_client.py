@@ -0,0 +1,51 @@
+"""Helpers for driving the Dash callbacks of `allervis` through the Flask test client (no network)."""
+import json
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+
+def load_app():
+    # allervis reads its data through paths relative to the repository root
+    os.chdir(root)
+    import allervis
+    return allervis
+
+
+def callback_payload(output, inputs, state=()):
+    component_id, component_property = output.split('.')
+    return {
+        'output': output,
+        'outputs': {'id': component_id, 'property': component_property},
+        'inputs': [{'id': i.split('.')[0], 'property': i.split('.')[1], 'value': v} for i, v in inputs],
+        'state': [{'id': s.split('.')[0], 'property': s.split('.')[1], 'value': v} for s, v in state],
+        'changedPropIds': [i for i, _ in inputs],
+    }
+
+
+def map_inputs(allergens, region, idiom, scheme, year_mode='latest', year=None, imputation='median', scaling='max'):
+    return [('allergens.value', list(allergens)), ('regions.value', region),
+            ('map_idiom_selector.value', idiom), ('color_scheme_selector.value', scheme),
+            ('year_mode.value', year_mode), ('year_slider.value', year),
+            ('imputation_selector.value', imputation), ('scaling_selector.value', scaling)]
+
+
+def barchart_inputs(allergens, region, year_mode='latest', year=None, imputation='median', scaling='max'):
+    return [('allergens.value', list(allergens)), ('regions.value', region),
+            ('year_mode.value', year_mode), ('year_slider.value', year),
+            ('imputation_selector.value', imputation), ('scaling_selector.value', scaling)]
+
+
+def post_callback(client, output, inputs, state=()):
+    response = client.post('/_dash-update-component', data=json.dumps(callback_payload(output, inputs, state)),
+                           content_type='application/json')
+    if response.status_code != 200:
+        raise RuntimeError(f'{output} returned HTTP {response.status_code}')
+    return response.get_data()
+
+
+def figure_of(body, output):
+    component_id, component_property = output.split('.')
+    return json.loads(body)['response'][component_id][component_property]
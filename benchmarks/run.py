@@ -0,0 +1,374 @@
+"""Benchmark and load-test suite for the Dash callbacks, with baselines to catch regressions.
+
+    python benchmarks/run.py matrix [--repeat 20] [--regions world,europe|all]
+    python benchmarks/run.py replay [--trace benchmarks/traces/session.jsonl] [--clients 8] [--speed 0]
+    python benchmarks/run.py synthesize [--out benchmarks/traces/session.jsonl] [--seed 0]
+    python benchmarks/run.py record [--out trace.jsonl] [--port 8050]
+
+`matrix` calls the callbacks (`update_map`, `update_barchart`, `update_allergen_store`,
+`display_status`) directly, across allergen subsets, regions, map idioms and color schemes,
+cold (the figure cache cleared before every call) and warm. `replay` replays an interaction
+trace, the requests the browser sent to `/_dash-update-component` one JSON per line, against
+the Flask `server` from concurrent simulated clients, through the test client (no network).
+`record` serves the app and writes the requests of a real browser session to a trace, and
+`synthesize` writes a scripted one (the default trace was made this way).
+
+Both benchmarks report p50/p95/p99 latency, throughput and payload size, plus the RSS of the
+process and, for the matrix, the peak of the Python allocations of one cold call. With
+`--save-baseline` the results are stored in `benchmarks/baselines.json`; with `--compare` they
+are checked against it, and the exit status is 1 when a latency (`--metric`, the median by
+default) got slower by more than `--tolerance` or a payload changed size. Latencies only
+compare on the machine that recorded the baseline: record a new one before comparing elsewhere.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+from dash_client import load_app, callback_payload, map_inputs, barchart_inputs
+
+here = os.path.dirname(os.path.abspath(__file__))
+baselines_path = os.path.join(here, 'baselines.json')
+default_trace = os.path.join(here, 'traces', 'session.jsonl')
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) / 1024
+    except (FileNotFoundError, StopIteration):
+        return float('nan')
+
+
+def peak_rss_mb():
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def summary(seconds, sizes, wall=None):
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'n': len(ms), 'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'throughput': round(len(ms) / (wall if wall is not None else ms.sum() / 1000), 1),
+            'bytes': int(np.mean(sizes))}
+
+
+def print_table(results, extra=()):
+    width = max(len(name) for name in results)
+    columns = ['n', 'p50_ms', 'p95_ms', 'p99_ms', 'throughput', 'bytes'] + list(extra)
+    print(f'{"":<{width}} ' + ' '.join(f'{column:>10}' for column in columns))
+    for name, result in results.items():
+        print(f'{name:<{width}} ' + ' '.join(f'{result.get(column, ""):>10}' for column in columns))
+
+
+def plain(callback):
+    # the function behind a callback registered with `@app.callback` (the registered one needs Dash's context)
+    return getattr(callback, '__wrapped__', callback)
+
+
+# -------------------------------------------------------------------------------------
+# Callback matrix
+
+def matrix_scenarios(allervis, regions):
+    subsets = {'single': ['Milk'], 'pair': ['Wheat', 'Rye'], 'common': allervis.list_of_common_allergens,
+               'all': allervis.list_of_allergens}
+    for (subset, allergens), region in itertools.product(subsets.items(), regions):
+        yield (f'barchart/{subset}/{region}',
+               lambda a=allergens, r=region: allervis.update_barchart(a, r, 'latest', None))
+        for idiom, scheme in itertools.product(['choropleth', 'bubble'], ['sequential', 'mpa', 'lpa']):
+            yield (f'map/{subset}/{region}/{idiom}/{scheme}',
+                   lambda a=allergens, r=region, i=idiom, s=scheme: allervis.update_map(a, r, i, s, 'latest', None))
+    if allervis.dataset.strategies_available:
+        # strategies other than the default one (their matrices are computed by the first call)
+        common = allervis.list_of_common_allergens
+        for imputation, scaling in (('mean', 'zscore'), ('zero', 'continent')):
+            yield (f'barchart/common/world/{imputation}:{scaling}',
+                   lambda i=imputation, s=scaling: allervis.update_barchart(common, 'world', 'latest', None, i, s))
+            yield (f'map/common/world/choropleth/mpa/{imputation}:{scaling}',
+                   lambda i=imputation, s=scaling: allervis.update_map(common, 'world', 'choropleth', 'mpa',
+                                                                       'latest', None, i, s))
+    for region in regions:
+        # the drill-down of a country clicked on the map
+        yield (f'country/common/{region}',
+               lambda r=region: allervis.update_country_figure('FRA', allervis.list_of_common_allergens, r,
+                                                               'latest', None))
+    yield 'allergen_store/latest', lambda: allervis.update_allergen_store('latest', None)
+    for selector in ('all', 'common', 'custom'):
+        yield f'display_status/{selector}', lambda s=selector: plain(allervis.display_status)(s)
+
+
+def run_matrix(allervis, args):
+    regions = [option['value'] for option in allervis.dataset.regions.options()] if args.regions == 'all' \
+        else args.regions.split(',')
+    results = {}
+    rss_before = rss_mb()
+    for name, call in matrix_scenarios(allervis, regions):
+        for cache in ('cold', 'warm'):
+            if cache == 'warm':
+                call()
+            seconds, sizes = [], []
+            for _ in range(args.repeat):
+                if cache == 'cold':
+                    allervis.figure_cache.clear()
+                start = time.perf_counter()
+                output = call()
+                seconds.append(time.perf_counter() - start)
+                sizes.append(len(json.dumps(output, cls=PlotlyJSONEncoder)))
+            result = summary(seconds, sizes)
+            if cache == 'cold':
+                allervis.figure_cache.clear()
+                tracemalloc.start()
+                call()
+                result['alloc_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024)
+                tracemalloc.stop()
+            results[f'{name}/{cache}'] = result
+    print_table(results, extra=['alloc_kb'])
+    print(f'\nRSS {rss_before:.0f} -> {rss_mb():.0f} MB, peak {peak_rss_mb():.0f} MB')
+    return results
+
+
+# -------------------------------------------------------------------------------------
+# Trace replay
+
+def read_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_replay(allervis, args):
+    trace = read_trace(args.trace)
+    if not args.warm:
+        allervis.figure_cache.clear()
+
+    def client(c):
+        test_client = allervis.server.test_client()
+        timings = []
+        # the clients start at different points of the session, so that they do not all ask for the same figures
+        offset = c * len(trace) // args.clients
+        previous = None
+        for entry in trace[offset:] + trace[:offset]:
+            if args.speed and previous is not None:
+                time.sleep(max(entry['t'] - previous, 0) / args.speed)
+            previous = entry['t']
+            start = time.perf_counter()
+            response = test_client.post('/_dash-update-component', data=json.dumps(entry['payload']),
+                                        content_type='application/json')
+            body = response.get_data()
+            timings.append((entry['payload']['output'], response.status_code, time.perf_counter() - start,
+                            len(body)))
+        return timings
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        timings = [timing for timings in pool.map(client, range(args.clients)) for timing in timings]
+    wall = time.perf_counter() - start
+
+    failures = [timing for timing in timings if timing[1] not in (200, 204)]
+    results = {}
+    for output in sorted({timing[0] for timing in timings}):
+        selected = [timing for timing in timings if timing[0] == output]
+        results[output] = summary([t[2] for t in selected], [t[3] for t in selected], wall)
+    results['all'] = summary([t[2] for t in timings], [t[3] for t in timings], wall)
+    print_table(results)
+    print(f'\n{len(timings)} requests from {args.clients} clients in {wall:.2f} s, {len(failures)} failed; '
+          f'RSS {rss_before:.0f} -> {rss_mb():.0f} MB, peak {peak_rss_mb():.0f} MB')
+    results['all']['rss_mb'] = round(rss_mb())
+    return results
+
+
+# -------------------------------------------------------------------------------------
+# Traces
+
+def synthesize(allervis, args):
+    # a scripted session: page load, then a user exploring the dashboard with pauses between actions
+    rng = random.Random(args.seed)
+    years = sorted(allervis.dataset.years)
+    state = {'allergens': list(allervis.list_of_allergens), 'region': 'world', 'idiom': 'choropleth',
+             'scheme': 'mpa', 'year_mode': 'latest', 'year': max(years, default=0)}
+    regions = [option['value'] for option in allervis.dataset.regions.options()]
+    trace = []
+    clock = [0.0]
+
+    def send(output, inputs):
+        trace.append({'t': round(clock[0], 3), 'payload': callback_payload(output, inputs)})
+
+    def figures(map_only=False):
+        send('map_graph.figure', map_inputs(state['allergens'], state['region'], state['idiom'], state['scheme'],
+                                            state['year_mode'], state['year']))
+        if not map_only:
+            send('stack_barchart_graph.figure', barchart_inputs(state['allergens'], state['region'],
+                                                                state['year_mode'], state['year']))
+
+    def selector(value):
+        send('allergens.value', [('allergen_selector.value', value)])
+        state['allergens'] = plain(allervis.display_status)(value)
+        figures()
+
+    def year_mode(value):
+        state['year_mode'] = value
+        send('year_slider.disabled', [('year_mode.value', value)])
+        figures()
+
+    # page load: every callback fires with the initial values, then the "common" preset applies
+    year_mode('latest')
+    selector('common')
+
+    for _ in range(args.actions):
+        clock[0] += rng.uniform(0.5, 3.0)
+        action = rng.choice(['toggle', 'toggle', 'region', 'region', 'idiom', 'scheme', 'selector', 'years'])
+        if action == 'toggle':
+            allergen = rng.choice(allervis.list_of_allergens)
+            state['allergens'] = [a for a in state['allergens'] if a != allergen] \
+                if allergen in state['allergens'] else state['allergens'] + [allergen]
+            figures()
+        elif action == 'region':
+            state['region'] = rng.choice(regions)
+            figures()
+        elif action == 'idiom':
+            state['idiom'] = 'bubble' if state['idiom'] == 'choropleth' else 'choropleth'
+            figures(map_only=True)
+        elif action == 'scheme':
+            state['scheme'] = rng.choice([s for s in ('sequential', 'mpa', 'lpa') if s != state['scheme']])
+            figures(map_only=True)
+        elif action == 'selector':
+            selector(rng.choice(['all', 'common']))
+        elif years:
+            # dragging the year slider over a few consecutive years, then back to the latest values
+            year_mode('year')
+            first = rng.randrange(len(years))
+            for year in years[first:first + rng.randint(3, 6)]:
+                clock[0] += rng.uniform(0.1, 0.3)
+                state['year'] = year
+                figures()
+            clock[0] += rng.uniform(0.5, 3.0)
+            year_mode('latest')
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        for entry in trace:
+            f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+    print(f'{len(trace)} requests over {clock[0]:.0f} s written to {args.out}')
+
+
+def record(allervis, args):
+    from flask import request
+
+    lock = threading.Lock()
+    start = time.perf_counter()
+    out = open(args.out, 'w')
+
+    @allervis.server.before_request
+    def log_callback():
+        if request.path.endswith('/_dash-update-component'):
+            entry = {'t': round(time.perf_counter() - start, 3), 'payload': request.get_json(silent=True)}
+            with lock:
+                out.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                out.flush()
+
+    print(f'recording the callbacks of http://127.0.0.1:{args.port}/ to {args.out}, stop with Ctrl+C')
+    try:
+        allervis.app.run_server(port=args.port)
+    finally:
+        out.close()
+
+
+# -------------------------------------------------------------------------------------
+# Baselines
+
+def compare(section, results, baseline, metric, tolerance):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        # below half a millisecond, differences are noise
+        if result[metric] > reference[metric] * (1 + tolerance) and result[metric] - reference[metric] > 0.5:
+            regressions.append(f'{section} {name}: {metric} {reference[metric]} -> {result[metric]}')
+        if abs(result['bytes'] - reference['bytes']) > 0.01 * reference['bytes']:
+            regressions.append(f'{section} {name}: payload {reference["bytes"]} -> {result["bytes"]} bytes')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    matrix = subparsers.add_parser('matrix')
+    matrix.add_argument('--repeat', type=int, default=20)
+    matrix.add_argument('--regions', default='world,europe', help='comma-separated, or "all"')
+
+    replay = subparsers.add_parser('replay')
+    replay.add_argument('--trace', default=default_trace)
+    replay.add_argument('--clients', type=int, default=8)
+    replay.add_argument('--speed', type=float, default=0,
+                        help='replay speed relative to the recording (1 = real time), 0 = no pauses')
+    replay.add_argument('--warm', action='store_true', help='keep the figures cached by the app')
+
+    for benchmark in (matrix, replay):
+        benchmark.add_argument('--save-baseline', action='store_true')
+        benchmark.add_argument('--compare', action='store_true')
+        benchmark.add_argument('--tolerance', type=float, default=0.25)
+        benchmark.add_argument('--metric', default='p50_ms', choices=['p50_ms', 'p95_ms', 'p99_ms'],
+                               help='the latency compared with the baseline (the tail ones are noisier)')
+
+    synthesized = subparsers.add_parser('synthesize')
+    synthesized.add_argument('--out', default=default_trace)
+    synthesized.add_argument('--seed', type=int, default=0)
+    synthesized.add_argument('--actions', type=int, default=60)
+
+    recorded = subparsers.add_parser('record')
+    recorded.add_argument('--out', default='trace.jsonl')
+    recorded.add_argument('--port', type=int, default=8050)
+
+    args = parser.parse_args()
+    if args.command in ('synthesize', 'record'):
+        args.out = os.path.abspath(args.out)
+    if args.command == 'replay':
+        args.trace = os.path.abspath(args.trace)
+    allervis = load_app()
+
+    if args.command == 'synthesize':
+        return synthesize(allervis, args)
+    if args.command == 'record':
+        return record(allervis, args)
+
+    results = run_matrix(allervis, args) if args.command == 'matrix' else run_replay(allervis, args)
+
+    baselines = {}
+    if os.path.exists(baselines_path):
+        with open(baselines_path) as f:
+            baselines = json.load(f)
+    status = 0
+    if args.compare:
+        regressions = compare(args.command, results, baselines.get(args.command, {}), args.metric, args.tolerance)
+        print(f'\n{len(regressions)} regressions against {baselines_path}')
+        for regression in regressions:
+            print('  ' + regression)
+        status = 1 if regressions else 0
+    if args.save_baseline:
+        baselines['machine'] = {'platform': platform.platform(), 'python': platform.python_version(),
+                                'processor': platform.processor() or platform.machine(), 'cpus': os.cpu_count()}
+        baselines[args.command] = results
+        with open(baselines_path, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f'baseline saved to {baselines_path}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Concurrency stress test: overlapping map and bar-chart callbacks must each return the correct figure.
+
+Every input combination is first rendered serially to get its expected figure. The same
+combinations are then fired in a shuffled order from a thread pool against the Flask
+`server`, and each response is compared with its serial counterpart.
+
+    python benchmarks/stress_concurrency.py [--threads 16] [--rounds 4]
+"""
+import argparse
+import itertools
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from dash_client import load_app, post_callback, map_inputs, barchart_inputs
+
+
+def requests_matrix(allervis):
+    subsets = [allervis.list_of_common_allergens, allervis.list_of_allergens, ['Wheat', 'Rye'], ['Milk']]
+    regions = ['world', 'europe', 'asia', 'oceania']
+    for allergens, region in itertools.product(subsets, regions):
+        yield 'stack_barchart_graph.figure', barchart_inputs(allergens, region)
+        yield 'stack_barchart_graph.figure', barchart_inputs(allergens, region, 'year', 1990)
+        for idiom, scheme in itertools.product(['choropleth', 'bubble'], ['sequential', 'mpa', 'lpa']):
+            yield 'map_graph.figure', map_inputs(allergens, region, idiom, scheme)
+    # z-scores are negative for some countries: the bubbles are shifted, also in the animation
+    for year_mode, scheme in itertools.product(['latest', 'animate'], ['sequential', 'mpa', 'lpa']):
+        yield 'map_graph.figure', map_inputs(allervis.list_of_common_allergens, 'world', 'bubble', scheme, year_mode,
+                                             imputation='mean', scaling='zscore')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    allervis = load_app()
+    requests = list(requests_matrix(allervis))
+
+    client = allervis.server.test_client()
+    expected = [post_callback(client, output, inputs) for output, inputs in requests]
+    # start cold, so that concurrent requests build their figures instead of reading them from the cache
+    allervis.figure_cache.clear()
+
+    jobs = list(range(len(requests))) * args.rounds
+    random.Random(args.seed).shuffle(jobs)
+
+    def run(job):
+        output, inputs = requests[job]
+        return job, post_callback(allervis.server.test_client(), output, inputs)
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        mismatches = [job for job, body in pool.map(run, jobs) if body != expected[job]]
+
+    print(f'{len(jobs)} callbacks on {args.threads} threads, {len(mismatches)} incorrect figures')
+    for job in sorted(set(mismatches))[:10]:
+        print('  mismatch:', requests[job][0], [value for _, value in requests[job][1]])
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import plotly.graph_objects as go
+
+import figures
+
+
+# ------------------------------------------------------------------------------
+# Browser-side rendering
+#
+# In clientside mode the normalized allergen matrix is shipped to the browser once
+# (per selected year) through a `dcc.Store`, and the map and bar chart are built
+# by the functions in `assets/allervis.js`. Changing the allergens, the region, the
+# map idiom or the color scheme then never reaches the server. The payload holds
+# everything those functions need to reproduce the server-side figures: the
+# matrix, the country labels, the region index and the Plotly template and colors.
+
+def region_payload(region):
+    return {'scope': region.scope,
+            'geo': go.layout.Geo(**region.geo).to_plotly_json(),
+            'positions': region.positions.tolist(),
+            'world': region.is_world}
+
+
+def client_payload(dataset, year=None, decimals=6, strategy=None):
+    matrix = dataset.year_matrix(year, strategy)
+    return {
+        'allergens': dataset.allergens,
+        'codes': dataset.codes.tolist(),
+        'entities': [str(entity) for entity in dataset.entities],
+        'values': matrix.values.astype(float).round(decimals).tolist(),
+        'regions': {option['value']: region_payload(dataset.regions[option['value']])
+                    for option in dataset.regions.options()},
+        # the same colors and template as the figures built by the server
+        'colors': figures.discrete_colors(),
+        'colorscale': figures.continuous_colorscale(),
+        'template': figures.template_json(),
+    }
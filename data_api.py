@@ -0,0 +1,178 @@
+import importlib.util
+
+import numpy as np
+import pandas as pd
+from flask import Response, abort, request, stream_with_context
+
+from query import requested_strategy, requested_year, selection
+
+
+# ------------------------------------------------------------------------------
+# Data API
+#
+# `GET /api/prevalence.<csv|ndjson|arrow>` returns, for an allergen selection and a
+# region, the table behind the bar chart: one row per country with its rank, the
+# aggregated prevalence, the most and least prevalent allergen and the value of
+# every selected allergen. It uses the same vectorized aggregation as the figures.
+#
+#   allergens   comma-separated (default: every allergen)
+#   region      a value of the region dropdown (default: world)
+#   year        a year of the time series (default: the most recent values; 400 for
+#               years it does not cover)
+#   order       desc (default) or asc, by aggregated prevalence
+#   top         the first k rows of the ranking, same as limit=k
+#   offset      rows to skip, for pagination (the total is in `X-Total-Count`)
+#   limit       rows to return after the offset
+#   top_allergens  the n most prevalent selected allergens of each country and their
+#               values, as columns top_<i>_allergen and top_<i>_prevalence
+#   imputation, scaling  the strategy applied to the raw values (see normalization.py,
+#               default: median and share of the maximum)
+#
+# The rows are written in chunks as the response is sent, never as one string.
+
+media_types = {'csv': 'text/csv',
+               'ndjson': 'application/x-ndjson',
+               'arrow': 'application/vnd.apache.arrow.stream'}
+
+chunk_rows = 1000
+
+# the values are float32: the text formats write them as float64 rounded to this many decimals (as in the client
+# payload of clientside.py), not as their shortest float32 repr with digits the data does not have (0.62222224)
+text_decimals = 6
+
+
+def arrow_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def ranking(dataset, selected_allergens, region, year=None, descending=True, strategy=None):
+    # positions of the region's rows and their aggregation, ordered by aggregated prevalence
+    matrix = dataset.year_matrix(year, strategy)
+    aggregation = matrix.aggregate(selected_allergens)
+    positions = dataset.regions.get(region).positions
+    key = aggregation.selected_set[positions]
+    order = np.argsort(-key if descending else key, kind='stable')
+    return matrix, aggregation, positions[order]
+
+
+def labels(values, categories):
+    # a column of labels with a fixed set of categories: dictionary-encoded in Arrow, the same in CSV and NDJSON
+    return pd.Categorical(values, categories=categories)
+
+
+def table(dataset, matrix, aggregation, selected_allergens, positions, first_rank, top=None):
+    frame = pd.DataFrame({
+        'rank': np.arange(first_rank, first_rank + len(positions)),
+        'code': dataset.codes.take(positions),
+        'entity': dataset.entities.take(positions),
+        'continent': labels(dataset.continents.take(positions), dataset.continent_labels),
+        'selected_set': aggregation.selected_set.take(positions),
+        'most_prevalent_allergen': labels(aggregation.most_prevalent_allergen.take(positions), matrix.allergens),
+        'least_prevalent_allergen': labels(aggregation.least_prevalent_allergen.take(positions), matrix.allergens),
+    })
+    values = matrix.values.take(positions, axis=0).take(matrix.column_indices(selected_allergens), axis=1)
+    for j, allergen in enumerate(selected_allergens):
+        frame[allergen] = values[:, j]
+    if top is not None:
+        names, top_values = top[0].take(positions, axis=0), top[1].take(positions, axis=0)
+        for i in range(names.shape[1]):
+            frame[f'top_{i + 1}_allergen'] = labels(names[:, i], matrix.allergens)
+            frame[f'top_{i + 1}_prevalence'] = top_values[:, i]
+    return frame
+
+
+def frames(dataset, matrix, aggregation, selected_allergens, positions, first_rank=1, top=None):
+    # the table in chunks of `chunk_rows` rows, each built when the previous one has been sent
+    for start in range(0, max(len(positions), 1), chunk_rows):
+        yield table(dataset, matrix, aggregation, selected_allergens, positions[start:start + chunk_rows],
+                    first_rank + start, top)
+
+
+def text_values(frame):
+    floats = frame.select_dtypes('floating').columns
+    return frame.astype({column: np.float64 for column in floats}).round(text_decimals)
+
+
+def csv_stream(frames):
+    for i, frame in enumerate(frames):
+        yield text_values(frame).to_csv(header=i == 0, index=False)
+
+
+def ndjson_stream(frames):
+    for frame in frames:
+        if len(frame):
+            yield text_values(frame).to_json(orient='records', lines=True) + '\n'
+
+
+class _Sink:
+    # a file-like object whose content is handed out after every record batch
+    def __init__(self):
+        self.parts = []
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def arrow_stream(frames):
+    import pyarrow as pa
+
+    sink = _Sink()
+    writer = None
+    for frame in frames:
+        if writer is None:
+            schema = pa.Schema.from_pandas(frame, preserve_index=False)
+            writer = pa.ipc.new_stream(sink, schema)
+        writer.write_batch(pa.RecordBatch.from_pandas(frame, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+streams = {'csv': csv_stream, 'ndjson': ndjson_stream, 'arrow': arrow_stream}
+
+
+# -------------------------------------------------------------------------------------
+
+def register(server, current_dataset):
+    @server.route('/api/prevalence.<data_format>')
+    def prevalence(data_format):
+        if data_format not in media_types:
+            abort(404)
+        if data_format == 'arrow' and not arrow_available():
+            return Response('Arrow output requires the pyarrow package\n', status=501, mimetype='text/plain')
+
+        # one snapshot for the whole response, even when a reload (see reload.py) replaces it meanwhile
+        dataset = current_dataset()
+
+        selected = selection(dataset.allergens, dataset.allergens)
+        region = request.args.get('region', 'world')
+        year = requested_year(dataset)
+        order = request.args.get('order', 'desc')
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', request.args.get('top', type=int), type=int)
+        top_allergens = request.args.get('top_allergens', 0, type=int)
+        strategy = requested_strategy(dataset)
+        if region not in dataset.regions or order not in ('asc', 'desc') or offset < 0 \
+                or (limit is not None and limit < 0) or top_allergens < 0:
+            abort(400)
+
+        matrix, aggregation, positions = ranking(dataset, selected, region, year, descending=order == 'desc',
+                                             strategy=strategy)
+        total = len(positions)
+        positions = positions[offset:None if limit is None else offset + limit]
+        top = matrix.top_allergens(selected, top_allergens) if top_allergens else None
+        rows = frames(dataset, matrix, aggregation, selected, positions, first_rank=offset + 1, top=top)
+
+        response = Response(stream_with_context(streams[data_format](rows)), mimetype=media_types[data_format])
+        response.headers['X-Total-Count'] = str(total)
+        return response
@@ -0,0 +1,98 @@
+import base64
+
+import numpy as np
+
+import metrics
+
+
+# ------------------------------------------------------------------------------
+# Compact figure payloads
+#
+# The map and bar chart responses are mostly per-country numbers. Three things keep
+# them small:
+#
+#   - compression: responses are compressed with Brotli or gzip, whichever the
+#     browser accepts (Dash alone only offers gzip)
+#   - quantization: the values of the traces are rounded to a number of decimals,
+#     so that 0.1235 is sent instead of 0.12345677614212036 (the float32 values
+#     of the dataset, widened to float64, print with up to 17 digits). Values are
+#     scaled to the unit range by default, and 4 decimals is finer than any color
+#     or bubble size can show
+#   - typed arrays: numeric arrays sent as base64 binary
+#     (`{"dtype": "f4", "bdata": "..."}`), which Plotly.js decodes from version
+#     2.28 on (Dash 2.15 and later). Off by default: the Plotly.js bundled with
+#     the Dash release of `requirements.txt` cannot read them
+#
+# `benchmarks/bench_encoding.py` reports the bytes of every callback output under
+# each of them, and /metrics the size of the responses before and after compression.
+
+default_decimals = 4
+
+# the numeric properties of the traces sent as typed arrays
+typed_paths = ('x', 'y', 'z', 'text', 'marker.size', 'marker.color')
+
+
+def quantize(values, decimals):
+    # `values` rounded to `decimals` decimals as float64, unchanged when `decimals` is None
+    if decimals is None:
+        return values
+    return np.round(np.asarray(values, dtype=np.float64), decimals)
+
+
+def typed_array(values):
+    # integers in the smallest type that holds them, floats as float32
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+        for dtype, code in ((np.uint8, 'u1'), (np.int8, 'i1'), (np.int16, 'i2'), (np.int32, 'i4')):
+            if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+                values = values.astype(dtype)
+                break
+        else:
+            values, code = values.astype(np.float64), 'f8'
+    else:
+        values, code = values.astype(np.float32), 'f4'
+    return {'dtype': code, 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+def encode_typed_arrays(trace):
+    # the numeric arrays of a trace dict (as `to_plotly_json()` returns it) replaced by typed arrays, in place
+    for path in typed_paths:
+        parent = trace
+        *parents, name = path.split('.')
+        for part in parents:
+            parent = parent.get(part)
+            if not isinstance(parent, dict):
+                break
+        else:
+            value = parent.get(name)
+            if isinstance(value, np.ndarray) and value.ndim == 1 and value.dtype.kind in 'iubf':
+                parent[name] = typed_array(value)
+    return trace
+
+
+# -------------------------------------------------------------------------------------
+# Response compression
+
+# what Flask-Compress compresses by default, and the scripts of the Dash components (served as text/javascript)
+mimetypes = ['text/html', 'text/css', 'text/xml', 'application/json', 'application/javascript', 'text/javascript']
+
+
+def register(server, algorithms=('br', 'gzip'), br_level=5, gzip_level=6):
+    # called before metrics.register: the hooks of Flask run in reverse order, so the sizes in `response_bytes`
+    # are taken before compression and the ones here after it
+    from flask import request
+    from flask_compress import Compress
+
+    @server.after_request
+    def record_encoded_size(response):
+        if response.content_length is not None and request.endpoint not in ('metrics', 'profile'):
+            metrics.encoded_bytes.observe(response.content_length, metrics.endpoint(),
+                                          response.headers.get('Content-Encoding', 'identity'))
+        return response
+
+    # Brotli level 5 compresses the figures better than gzip in about the same time (levels above 8 take tens
+    # of milliseconds)
+    server.config.update(COMPRESS_ALGORITHM=list(algorithms), COMPRESS_BR_LEVEL=br_level, COMPRESS_LEVEL=gzip_level,
+                         COMPRESS_MIMETYPES=mimetypes)
+    Compress(server)
@@ -0,0 +1,208 @@
+import hashlib
+import importlib.util
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Response, abort, request
+
+from figure_cache import MemoryBackend
+from figures import color_schemes, map_idioms
+from query import requested_strategy, requested_year, selection
+
+
+# ------------------------------------------------------------------------------
+# Static image export
+#
+# `GET /export/map.png?allergens=Milk,Egg&region=europe&idiom=bubble&scheme=mpa`
+# (and `/export/barchart.svg`, ...) returns a snapshot of a figure of the app, for
+# reports and dashboards that embed the maps and poll them. The figure comes from
+# the figure cache of the app; turning it into an image is left to Kaleido in a
+# bounded pool of worker processes, each keeping its Kaleido renderer warm.
+#
+# Finished images are cached by their parameters (and the dataset version), and
+# identical requests that arrive while an image is being rendered wait for that
+# render instead of starting their own. Requests beyond `max_pending` renders are
+# turned away with 503 rather than queued without bound.
+#
+# The workers are spawned, not forked: the app serves requests from several threads,
+# and forking a threaded process is not safe. A pool whose worker died (e.g. killed
+# for its memory) is replaced by the next render.
+
+formats = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# the accepted `width` and `height` (pixels) and `scale` of an image
+size_range = (10, 4096)
+scale_range = (0.1, 8.0)
+
+
+def kaleido_available():
+    return importlib.util.find_spec('kaleido') is not None
+
+
+def start_worker(topojson):
+    # Kaleido fetches the map outlines from the Plotly CDN unless given a local copy
+    if topojson:
+        import plotly.io as pio
+        pio.kaleido.scope.topojson = topojson
+
+
+def render(figure, image_format, width, height, scale):
+    # runs in a worker process
+    import plotly.io as pio
+    return pio.to_image(figure, format=image_format, width=width, height=height, scale=scale, engine='kaleido')
+
+
+class Overloaded(Exception):
+    pass
+
+
+class RenderPool:
+    def __init__(self, workers=2, max_pending=32, max_entries=256, topojson=None):
+        self.workers = workers
+        self.topojson = topojson
+        self.max_pending = max_pending
+        self.images = MemoryBackend(max_entries)
+        self.hits = 0
+        self.renders = 0
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # started on first use, so that importing the app does not fork any process
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=start_worker,
+                                                 initargs=(self.topojson,),
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _replace_broken(self, executor):
+        # called with the lock held: the next render starts a new pool, unless another thread already did
+        if executor is not None and executor is self._executor:
+            executor.shutdown(wait=False)
+            self._executor = None
+
+    def _submit(self, *args):
+        executor = self._pool()
+        try:
+            return executor.submit(render, *args)
+        except BrokenProcessPool:
+            self._replace_broken(executor)
+            return self._pool().submit(render, *args)
+
+    def image(self, key, build_figure, image_format, width=None, height=None, scale=1):
+        image = self.images.load(key)
+        if image is not None:
+            with self._lock:
+                self.hits += 1
+            return image
+
+        with self._lock:
+            future = self._in_flight.get(key)
+        if future is None:
+            figure = build_figure()
+            submitted = False
+            with self._lock:
+                future = self._in_flight.get(key)
+                if future is None:
+                    if len(self._in_flight) >= self.max_pending:
+                        raise Overloaded()
+                    future = self._submit(figure, image_format, width, height, scale)
+                    executor = self._executor
+                    self._in_flight[key] = future
+                    self.renders += 1
+                    submitted = True
+            if submitted:
+                future.add_done_callback(lambda done, executor=executor: self._finish(key, done, executor))
+        # every request for the key, the first one included, waits on the same render
+        return future.result()
+
+    def _finish(self, key, future, executor):
+        error = future.exception()
+        if error is None:
+            self.images.store(key, future.result())
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if isinstance(error, BrokenProcessPool):
+                self._replace_broken(executor)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# -------------------------------------------------------------------------------------
+
+def bounded(name, kind, value_range, default=None):
+    # the query parameter `name`, `default` when not given, 400 when it is not a number within `value_range`
+    if not request.args.get(name):
+        return default
+    value = request.args.get(name, type=kind)
+    if value is None or not value_range[0] <= value <= value_range[1]:
+        abort(400, f'{name} must be between {value_range[0]} and {value_range[1]}')
+    return value
+
+
+def image_response(pool, version, kind, image_format, params, build_figure):
+    if image_format not in formats:
+        abort(404)
+    if not kaleido_available():
+        return Response('Image export requires the kaleido package\n', status=501, mimetype='text/plain')
+
+    width = bounded('width', int, size_range)
+    height = bounded('height', int, size_range)
+    scale = bounded('scale', float, scale_range, default=1)
+    key = ':'.join([version, kind, image_format, str(width), str(height), str(scale)] + [str(p) for p in params])
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304)
+
+    try:
+        image = pool.image(key, build_figure, image_format, width, height, scale)
+    except Overloaded:
+        return Response('Too many images being rendered\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '1'})
+    except BrokenProcessPool:
+        # the worker died during the render; the next one starts a new pool
+        return Response('The image renderer stopped, try again\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '1'})
+
+    response = Response(image, mimetype=formats[image_format])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response
+
+
+def register(server, current_dataset, pool, map_figure, barchart_figure, default_allergens=()):
+    @server.route('/export/map.<image_format>')
+    def export_map(image_format):
+        # the snapshot being served, which a reload may replace (see reload.py)
+        dataset = current_dataset()
+        selected = selection(dataset.allergens, default_allergens)
+        region = request.args.get('region', 'world')
+        idiom = request.args.get('idiom', 'choropleth')
+        scheme = request.args.get('scheme', 'sequential')
+        year = requested_year(dataset)
+        strategy = requested_strategy(dataset)
+        if region not in dataset.regions or idiom not in map_idioms or scheme not in color_schemes:
+            abort(400)
+        params = (','.join(selected), region, idiom, scheme, year, strategy)
+        return image_response(pool, dataset.version, 'map', image_format, params,
+                              lambda: map_figure(selected, region, idiom, scheme, year, strategy=strategy))
+
+    @server.route('/export/barchart.<image_format>')
+    def export_barchart(image_format):
+        dataset = current_dataset()
+        selected = selection(dataset.allergens, default_allergens)
+        region = request.args.get('region', 'world')
+        year = requested_year(dataset)
+        strategy = requested_strategy(dataset)
+        if region not in dataset.regions:
+            abort(400)
+        params = (','.join(selected), region, year, strategy)
+        return image_response(pool, dataset.version, 'barchart', image_format, params,
+                              lambda: barchart_figure(selected, region, year, strategy=strategy))
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+from metrics import stage
+
+
+# ------------------------------------------------------------------------------
+# Memoized figures
+#
+# The callback inputs form a small discrete space, so finished figures are cached
+# keyed on the canonicalized inputs. Entries are plain JSON-compatible dicts (what
+# Dash sends to the browser). Keys are prefixed with the dataset version, a hash
+# of `concatenated.csv`, so refreshing the data invalidates every old entry.
+#
+# Where the figures live is pluggable:
+#   - MemoryBackend: bounded in-process LRU (one per worker)
+#   - FileBackend: one atomically written JSON file per figure, shared by all
+#     workers on the machine, the least recently used ones removed past a bound
+#   - RedisBackend: any client speaking the Redis get/set protocol, shared by all
+#     workers of all machines, entries expiring after a TTL
+#
+# After a reload every backend drops the entries of other versions (`retain`).
+
+def figure_key(kind, selected_allergens, *params):
+    # the order in which allergens were picked does not change the figure
+    return (kind, tuple(sorted(selected_allergens))) + tuple(params)
+
+
+def figure_to_json(fig):
+    return json.loads(pio.to_json(fig, validate=False))
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self, key):
+        with self._lock:
+            figure = self._entries.get(key)
+            if figure is not None:
+                self._entries.move_to_end(key)
+            return figure
+
+    def store(self, key, figure):
+        with self._lock:
+            self._entries[key] = figure
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def retain(self, version):
+        # entries of other versions are never read again
+        with self._lock:
+            for key in [key for key in self._entries if not key.startswith(version + ':')]:
+                del self._entries[key]
+
+
+class FileBackend:
+    def __init__(self, directory, max_entries=4096):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._names())
+
+    def _names(self):
+        # the entries of the cache: the directory may hold other files, which are left alone
+        return [name for name in os.listdir(self.directory) if name.endswith('.figure.json')]
+
+    def _path(self, key):
+        # named <version>-<hash of the key>, so that the entries of a version can be found without reading them
+        version = key.split(':', 1)[0]
+        return os.path.join(self.directory, f'{version}-{hashlib.sha1(key.encode()).hexdigest()}.figure.json')
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                figure = json.load(f)
+        except FileNotFoundError:
+            return None
+        try:
+            # the modification time orders the entries for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return figure
+
+    def store(self, key, figure):
+        # write to a temporary file and rename it, so readers never see a partial figure
+        fd, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(figure, f, separators=(',', ':'))
+            os.replace(temporary_path, self._path(key))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        # past `max_entries`, remove the least recently used files; other workers may be removing them too
+        names = self._names()
+        if len(names) <= self.max_entries:
+            return
+        used = []
+        for name in names:
+            try:
+                used.append((os.stat(os.path.join(self.directory, name)).st_mtime, name))
+            except FileNotFoundError:
+                pass
+        used.sort()
+        for _, name in used[:len(used) - self.max_entries]:
+            self._remove(name)
+
+    def _remove(self, name):
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in self._names():
+            self._remove(name)
+
+    def retain(self, version):
+        for name in self._names():
+            if not name.startswith(version + '-'):
+                self._remove(name)
+
+
+class RedisBackend:
+    def __init__(self, client, prefix='allervis:figure:', ttl=None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, ttl=24 * 3600, **kwargs):
+        # `ttl` in seconds: entries of a version nobody serves any more (see retain) expire eventually
+        import redis
+        return cls(redis.Redis.from_url(url), ttl=ttl, **kwargs)
+
+    def load(self, key):
+        payload = self.client.get(self.prefix + key)
+        return None if payload is None else json.loads(payload)
+
+    def store(self, key, figure):
+        self.client.set(self.prefix + key, json.dumps(figure, separators=(',', ':')), ex=self.ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def retain(self, version):
+        current = (self.prefix + version + ':').encode()
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            if not (key if isinstance(key, bytes) else key.encode()).startswith(current):
+                self.client.delete(key)
+
+
+def backend_from_url(url, max_entries=256, file_entries=4096, ttl=24 * 3600):
+    # "memory", "file:<directory>" or "redis://host:port/db"; `max_entries` bounds the in-process LRU,
+    # `file_entries` the files and `ttl` (seconds) the lifetime of the Redis entries
+    if not url or url == 'memory':
+        return MemoryBackend(max_entries)
+    if url.startswith('file:'):
+        return FileBackend(url[len('file:'):], max_entries=file_entries)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend.from_url(url, ttl=ttl)
+    raise ValueError(f'Unknown figure cache backend: {url}')
+
+
+class FigureCache:
+    def __init__(self, backend=None, version=''):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _backend_key(self, key, version=None):
+        # `version`: the dataset the figure is built from, the current version when not given
+        version = self.version if version is None else version
+        return ':'.join([version] + [','.join(part) if isinstance(part, tuple) else str(part) for part in key])
+
+    def get(self, key, version=None):
+        return self._load(self._backend_key(key, version))
+
+    def _load(self, backend_key):
+        figure = self.backend.load(backend_key)
+        with self._lock:
+            if figure is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return figure
+
+    def put(self, key, figure, version=None):
+        self.backend.store(self._backend_key(key, version), figure)
+
+    def get_or_build(self, key, build, version=None):
+        # the key is resolved once, before building: a reload meanwhile (see reload.py) does not file the figure
+        # under the version that replaced the one it was built from
+        backend_key = self._backend_key(key, version)
+        figure = self._load(backend_key)
+        if figure is None:
+            # built outside any lock: concurrent misses on the same key may both build, the last one wins
+            figure = build()
+            with stage('serialization'):
+                figure = figure_to_json(figure)
+            self.backend.store(backend_key, figure)
+        return figure
+
+    def set_version(self, version):
+        # after a reload (see reload.py): entries of the previous version are never read again, drop them
+        self.version = version
+        self.backend.retain(version)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'backend': type(self.backend).__name__, 'version': self.version,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,73 @@
+# ------------------------------------------------------------------------------
+# Partial figure updates
+#
+# A figure is made of its layout (geo projection, axes, legend, the Plotly template)
+# and its traces. Picking another allergen or year only changes the traces, so in
+# patch mode the server sends a patch to a `dcc.Store` and `apply_patch` in
+# `assets/allervis.js` merges it into the figure the browser already shows:
+#
+#   - full: the whole figure, when the browser shows nothing yet or another layout
+#   - data: the traces only; the layout on the client is kept, and the properties
+#     all traces share (the countries of the bar chart) are sent once
+#   - restyle: only the values of the traces (`z`, marker color and size, the top
+#     allergens of the hover and the hover template that shows as many of them as
+#     there are), when the traces cover the same countries in the same order as the
+#     ones on the client
+#
+# Every patch carries the layout key of the figure it belongs to. The browser keeps
+# the key of the figure it shows and sends it back with the next request, so a patch
+# is only ever merged into a figure with the same layout, even when an earlier
+# response was dropped.
+
+# the trace properties that depend on the values of the selected allergens
+restyle_paths = ('z', 'marker.color', 'marker.size', 'marker.sizeref', 'customdata', 'hovertemplate')
+# the ones sent as null when the figure has none, so that the client drops its own (no top allergens without a
+# selection)
+cleared_paths = ('customdata',)
+# the trace properties that are sent once in a data patch when every trace has the same value
+shared_properties = ('x', 'locations', 'hovertext')
+
+
+def full(figure, key):
+    return {'kind': 'full', 'key': key, 'figure': figure}
+
+
+def data_only(figure, key):
+    # the stacked bars all share the countries of the x axis: send them once
+    data = figure['data']
+    shared = {}
+    if len(data) > 1:
+        for name in shared_properties:
+            values = [trace.get(name) for trace in data]
+            if values[0] is not None and all(value == values[0] for value in values[1:]):
+                shared[name] = values[0]
+    if shared:
+        data = [{name: value for name, value in trace.items() if name not in shared} for trace in data]
+    return {'kind': 'data', 'key': key, 'data': data, 'shared': shared}
+
+
+def _get_path(trace, path):
+    value = trace
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def restyle(figure, key):
+    updates = []
+    for trace in figure['data']:
+        values = {path: _get_path(trace, path) for path in restyle_paths}
+        updates.append({path: value for path, value in values.items()
+                        if value is not None or path in cleared_paths})
+    return {'kind': 'restyle', 'key': key, 'restyle': updates}
+
+
+def figure_patch(figure, key, client_key, same_traces=False):
+    # `client_key` is the layout key of the figure shown in the browser (None before the first one)
+    if client_key is None or list(key) != list(client_key):
+        return full(figure, key)
+    if same_traces:
+        return restyle(figure, key)
+    return data_only(figure, key)
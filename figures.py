@@ -0,0 +1,307 @@
+from functools import lru_cache
+
+import numpy as np
+from plotly.colors import qualitative, sequential
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from encoding import encode_typed_arrays, quantize
+from metrics import stage
+
+
+# ------------------------------------------------------------------------------
+# Figure construction
+#
+# The map and the bar chart are assembled directly from `go.Choropleth`,
+# `go.Scattergeo` and `go.Bar` traces fed with the arrays of the dataset snapshot
+# and of the aggregation, instead of going through Plotly Express (which melts the
+# table to long form and groups it by category on every call). The layouts, which
+# hold the whole Plotly template, only depend on the region, the map idiom and the
+# color scheme: they are validated once and reused, and each figure only validates
+# its own traces. The figures are the same as the ones Plotly Express draws: same
+# traces, labels, hover templates, colors and layout (see
+# `benchmarks/bench_figures.py`), up to the rounding of the values and the typed
+# arrays of encoding.py when they are asked for.
+
+sequential_colorscale = sequential.Blues
+
+color_labels = {'sequential': 'Prevalence',
+                'mpa': 'Most Prevalent Allergen',
+                'lpa': 'Least Prevalent Allergen'}
+
+# the map idioms and color schemes the dashboard offers and the image export accepts
+map_idioms = ('choropleth', 'bubble')
+color_schemes = tuple(color_labels)
+
+# the largest bubble, in pixels (the default `size_max` of Plotly Express)
+size_max = 20
+
+
+def template():
+    return pio.templates[pio.templates.default]
+
+
+@lru_cache(maxsize=None)
+def template_json():
+    return template().to_plotly_json()
+
+
+def discrete_colors():
+    # Plotly Express takes its discrete colors from the template first
+    return list(template().layout.colorway or qualitative.Plotly)
+
+
+def continuous_colorscale():
+    return [[i / (len(sequential_colorscale) - 1), color] for i, color in enumerate(sequential_colorscale)]
+
+
+def categories(labels):
+    # one trace per category, in alphabetical order, each over its own rows in table order
+    names = sorted(set(label for label in labels if label is not None))
+    return [(name, np.flatnonzero(labels == name)) for name in names]
+
+
+# -------------------------------------------------------------------------------------
+
+def assemble(traces, layout, typed_arrays=False):
+    # a figure dict, as `go.Figure(...).to_dict()` would return it, without validating the layout again
+    data = [trace.to_plotly_json() for trace in traces]
+    if typed_arrays:
+        data = [encode_typed_arrays(trace) for trace in data]
+    return {'data': data, 'layout': dict(layout, template=template_json())}
+
+
+@lru_cache(maxsize=None)
+def barchart_layout(showticklabels):
+    layout = go.Layout(
+        barmode='relative',
+        height=400,
+        title=dict(text='Aggregated Prevalence'),
+        legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1,
+                    title=dict(text='Allergen'), tracegroupgap=0),
+        margin=dict(l=10, r=10, b=20, t=20, pad=4),
+        xaxis=dict(anchor='y', domain=[0.0, 1.0], showticklabels=showticklabels),
+        yaxis=dict(anchor='x', domain=[0.0, 1.0]),
+    ).to_plotly_json()
+    # no axis titles, left as empty objects like Plotly Express does
+    layout['xaxis']['title'] = {}
+    layout['yaxis']['title'] = {}
+    return layout
+
+
+def barchart(dataset, selected_allergens, region, year=None, strategy=None, decimals=None, typed_arrays=False):
+    # `decimals`, `typed_arrays`: the encoding of the values (see encoding.py)
+    selected_allergens = sorted(selected_allergens)
+    matrix = dataset.year_matrix(year, strategy)
+
+    with stage('aggregation'):
+        selected_set = matrix.selected_set(selected_allergens)
+    with stage('sorting'):
+        # the region's countries, ascending by aggregated prevalence
+        order = dataset.regions.order(region.value, selected_set)
+    with stage('filtering'):
+        entities = dataset.entities.take(order)
+        columns = quantize(matrix.values.take(order, axis=0), decimals)
+
+    with stage('build'):
+        return assemble(bar_traces(selected_allergens, matrix, entities, columns),
+                        barchart_layout(not region.is_world), typed_arrays)
+
+
+def bar_traces(selected_allergens, matrix, entities, columns):
+    colors = discrete_colors()
+    traces = []
+    for c, allergen in enumerate(selected_allergens):
+        traces.append(go.Bar(
+            x=entities,
+            y=columns[:, matrix.column_indices([allergen])[0]],
+            name=allergen,
+            legendgroup=allergen,
+            offsetgroup=allergen,
+            alignmentgroup='True',
+            orientation='v',
+            showlegend=True,
+            textposition='auto',
+            marker=dict(color=colors[c % len(colors)]),
+            hovertemplate='Allergen=' + allergen + '<br>Country=%{x}<br>value=%{y}<extra></extra>',
+            xaxis='x',
+            yaxis='y',
+        ))
+    return traces
+
+
+# -------------------------------------------------------------------------------------
+
+@lru_cache(maxsize=64)
+def geo_layout(region, map_idiom, color_scheme):
+    bubble = map_idiom == 'bubble'
+    layout = go.Layout(
+        height=340,
+        margin=dict(l=5, r=5, b=0, t=0, pad=4) if bubble else dict(l=10, r=10, b=0, t=0, pad=4),
+        legend=dict(tracegroupgap=0),
+        geo=dict(domain=dict(x=[0.0, 1.0], y=[0.0, 1.0]),
+                 scope=region.scope,
+                 landcolor='lightgray',
+                 showland=True,
+                 showcountries=True,
+                 countrycolor='gray',
+                 countrywidth=0.5,
+                 projection=dict(type='natural earth')),
+    )
+    if not bubble and region.scope == 'world':
+        layout.geo.visible = False
+    if bubble:
+        layout.legend.itemsizing = 'constant'
+    if color_scheme == 'sequential':
+        layout.coloraxis = dict(colorbar=dict(title=dict(text=color_labels['sequential'])),
+                                colorscale=continuous_colorscale())
+    else:
+        layout.legend.title = dict(text=color_labels[color_scheme])
+    if region.geo:
+        layout.geo.update(region.geo)
+
+    layout = layout.to_plotly_json()
+    # Plotly Express always sets a center, empty unless the region has one
+    layout['geo'].setdefault('center', {})
+    return layout
+
+
+def geo_map(dataset, selected_allergens, region, map_idiom, color_scheme, year=None, strategy=None, hover_top=0,
+            decimals=None, typed_arrays=False):
+    # `hover_top`: also list the most prevalent selected allergens of each country when hovering it
+    selected_allergens = sorted(selected_allergens)
+    matrix = dataset.year_matrix(year, strategy)
+    with stage('aggregation'):
+        aggregation = matrix.aggregate(selected_allergens)
+    groups = None
+    if color_scheme != 'sequential':
+        labels = aggregation.least_prevalent_allergen if color_scheme == 'lpa' \
+            else aggregation.most_prevalent_allergen
+        with stage('filtering'):
+            groups = categories(labels)
+
+    with stage('build'):
+        traces = geo_traces(dataset, aggregation.selected_set, groups, map_idiom, color_scheme, decimals)
+        if hover_top and selected_allergens:
+            names, values = matrix.top_allergens(selected_allergens, hover_top)
+            add_top_allergens(traces, groups, names, quantize(values, decimals))
+        return assemble(traces, geo_layout(region, map_idiom, color_scheme), typed_arrays)
+
+
+def add_top_allergens(traces, groups, names, values):
+    # the top allergens go to `customdata` (names, then values) and are appended to the hover template
+    n = names.shape[1]
+    lines = ''.join(f'<br>{i + 1}. %{{customdata[{i}]}}: %{{customdata[{n + i}]:.2f}}' for i in range(n))
+    customdata = np.concatenate([names, values.astype(object)], axis=1)
+    rows = [slice(None)] if groups is None else [positions for _, positions in groups]
+    for trace, positions in zip(traces, rows):
+        trace.customdata = customdata[positions]
+        trace.hovertemplate = trace.hovertemplate.replace('<extra>', lines + '<extra>')
+
+
+def geo_traces(dataset, prevalence, groups, map_idiom, color_scheme, decimals=None):
+    # `groups`: the rows of each category of the discrete schemes, None for the sequential one
+    codes, entities = dataset.codes, dataset.entities
+    bubble = map_idiom == 'bubble'
+    prevalence = sizes = quantize(prevalence, decimals)
+    if bubble and len(prevalence) and prevalence.min() < 0:
+        # some strategies (z-scores) give negative values: bubbles grow from the smallest value instead of zero,
+        # and the hover of the discrete schemes shows the values from `text`
+        sizes = quantize(prevalence - prevalence.min(), decimals)
+    shifted = sizes is not prevalence
+    sizeref = float(sizes.max()) / size_max ** 2 if len(sizes) else 1.0
+
+    traces = []
+    if groups is None:
+        if bubble:
+            traces.append(go.Scattergeo(
+                locations=codes, hovertext=entities, geo='geo', mode='markers', name='', legendgroup='',
+                showlegend=False,
+                marker=dict(color=prevalence, coloraxis='coloraxis', size=sizes,
+                            sizemode='area', sizeref=sizeref, symbol='circle'),
+                hovertemplate='<b>%{hovertext}</b><br><br>Prevalence=%{marker.color}<br>Code=%{location}'
+                              '<extra></extra>'))
+        else:
+            traces.append(go.Choropleth(
+                locations=codes, hovertext=entities, z=prevalence, geo='geo', name='', coloraxis='coloraxis',
+                hovertemplate='<b>%{hovertext}</b><br><br>Code=%{location}<br>Prevalence=%{z}<extra></extra>'))
+    else:
+        title = color_labels[color_scheme]
+        colors = discrete_colors()
+        for c, (name, positions) in enumerate(groups):
+            color = colors[c % len(colors)]
+            hovertemplate = '<b>%{hovertext}</b><br><br>' + title + '=' + name
+            if bubble:
+                traces.append(go.Scattergeo(
+                    locations=codes.take(positions), hovertext=entities.take(positions), geo='geo',
+                    mode='markers', name=name, legendgroup=name, showlegend=True,
+                    marker=dict(color=color, size=sizes.take(positions),
+                                sizemode='area', sizeref=sizeref, symbol='circle'),
+                    text=prevalence.take(positions) if shifted else None,
+                    hovertemplate=hovertemplate + '<br>Prevalence=' + ('%{text}' if shifted else '%{marker.size}') +
+                                  '<br>Code=%{location}<extra></extra>'))
+            else:
+                traces.append(go.Choropleth(
+                    locations=codes.take(positions), hovertext=entities.take(positions),
+                    z=np.ones(len(positions), dtype=np.int64), geo='geo', name=name, showlegend=True,
+                    showscale=False, colorscale=[[0.0, color], [1.0, color]],
+                    hovertemplate=hovertemplate + '<br>Code=%{location}<extra></extra>'))
+    return traces
+
+
+# -------------------------------------------------------------------------------------
+# Country drill-down: the history of a country (left) and where it ranks (right)
+
+percentile_colors = ('#636EFA', 'lightgray')
+
+
+@lru_cache(maxsize=None)
+def country_layout():
+    return go.Layout(
+        height=360,
+        margin=dict(l=10, r=10, b=20, t=40, pad=4),
+        legend=dict(orientation='h', yanchor='top', y=-0.15, xanchor='left', x=0, tracegroupgap=0),
+        barmode='group',
+        xaxis=dict(anchor='y', domain=[0.0, 0.55], title=dict(text='Year')),
+        yaxis=dict(anchor='x', domain=[0.0, 1.0], title=dict(text='Value in the source')),
+        xaxis2=dict(anchor='y2', domain=[0.68, 1.0], range=[0, 100], title=dict(text='Percentile rank')),
+        yaxis2=dict(anchor='x2', domain=[0.0, 1.0], autorange='reversed'),
+    ).to_plotly_json()
+
+
+def country_panel(dataset, code, selected_allergens, region, year=None, strategy=None, decimals=None,
+                  typed_arrays=False):
+    # the history of the country in the sources for the selected allergens, and the percentile ranks of its values
+    # (of `year` under `strategy`) among the countries of `region`, or of its continent when `region` does not hold
+    # it, and of the world
+    selected_allergens = sorted(selected_allergens)
+    position = dataset.regions.position(code)
+    traces = []
+
+    if dataset.history is not None:
+        with stage('lookup'):
+            years, history = dataset.history.series(code, selected_allergens)
+        colors = discrete_colors()
+        for c, allergen in enumerate(selected_allergens):
+            traces.append(go.Scatter(
+                x=years, y=quantize(history[:, c], decimals), name=allergen, legendgroup=allergen,
+                mode='lines+markers', marker=dict(color=colors[c % len(colors)], size=4),
+                hovertemplate='Allergen=' + allergen + '<br>Year=%{x}<br>value=%{y}<extra></extra>',
+                xaxis='x', yaxis='y'))
+
+    with stage('aggregation'):
+        matrix = dataset.year_matrix(year, strategy)
+        comparisons = [dataset.regions.containing(position, region.value), dataset.regions.get('world')]
+        comparisons = [comparison for comparison in comparisons if comparison is not None]
+        for comparison, color in zip(comparisons, percentile_colors):
+            ranks = matrix.percentile_ranks(position, comparison.positions, selected_allergens)
+            label = comparison.label.strip()
+            traces.append(go.Bar(
+                x=np.round(ranks, 1), y=selected_allergens, name='vs ' + label, orientation='h',
+                marker=dict(color=color),
+                hovertemplate='Allergen=%{y}<br>Percentile rank vs ' + label + '=%{x}<extra></extra>',
+                xaxis='x2', yaxis='y2'))
+
+    with stage('build'):
+        title = f'{dataset.entities[position]} ({code})'
+        return assemble(traces, dict(country_layout(), title=dict(text=title)), typed_arrays)
@@ -0,0 +1,43 @@
+from functools import lru_cache
+
+import numpy as np
+
+
+# ------------------------------------------------------------------------------
+# Per-country history
+#
+# The drill-down panel of a country shows the values of its sources for every year.
+# Scanning the source CSVs for them takes a read of every file; instead the build
+# stage writes them to `history.npy` of the artifact (see artifact.py), one row per
+# country in the order of `codes.npy`, each row holding the (years x allergens) values
+# of that country contiguously. The store maps ISO codes to rows once, so the history
+# of a country is a single seek into the memory-mapped file, and keeps the histories
+# of the most recently looked-up countries in a bounded cache.
+
+class CountryHistoryStore:
+    def __init__(self, values, years, codes, allergens, cache_size=64):
+        self._values = values
+        self.years = np.asarray(years, dtype=np.int16)
+        self.allergens = list(allergens)
+        self._rows = {code: row for row, code in enumerate(codes)}
+        self._columns = {allergen: j for j, allergen in enumerate(self.allergens)}
+        # per store, so that a reloaded dataset does not serve the cached histories of the old one
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def __contains__(self, code):
+        return code in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _lookup(self, code):
+        # a read-only copy of the (years x allergens) values of the country, NaN where a source has none
+        values = np.array(self._values[self._rows[code]], dtype=np.float64)
+        values.setflags(write=False)
+        return values
+
+    def series(self, code, selected_allergens):
+        # the years and the values of the selected allergens of the country, (years x selected); KeyError for
+        # codes that are not in the data
+        values = self.lookup(code)
+        return self.years, values.take([self._columns[allergen] for allergen in selected_allergens], axis=1)
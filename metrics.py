@@ -0,0 +1,227 @@
+import bisect
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, request
+
+
+# ------------------------------------------------------------------------------
+# Metrics
+#
+# Latency histograms of the figure callbacks (per callback and per combination of
+# the discrete inputs: region, idiom, color scheme, year mode) and of the stages
+# inside them (aggregation, sorting, filtering, figure build, JSON serialization),
+# response sizes, and the hit ratios of the caches, exposed in the Prometheus text
+# format on `/metrics`. The allergen selection is left out of the labels, it has
+# far too many values, and the values clients send that the app does not offer (an
+# unknown region, callback output, ...) are all labelled `other`.
+#
+# Recording an observation is a bisect and a few additions under a lock, cheap
+# enough to stay on under load. Metrics are per process: with several gunicorn
+# workers, each one is scraped separately.
+#
+# With a sampling rate (ALLERVIS_PROFILE, e.g. 0.01) a fraction of the callbacks
+# also runs under cProfile; the merged statistics are served on `/metrics/profile`.
+
+seconds_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+bytes_buckets = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 5000000)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=seconds_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # per-bucket counts (the last one above every bound), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def collect(self):
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, counts, total in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, label_values, [("le", bound)])} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {cumulative}')
+        return lines
+
+
+class Value:
+    # a counter or gauge read from elsewhere (e.g. the hit counts of a cache) when scraped
+    def __init__(self, name, documentation, kind, read):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.read = read
+
+    def collect(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}',
+                f'{self.name} {self.read()}']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self.metrics.append(histogram)
+        return histogram
+
+    def value(self, name, documentation, read, kind='gauge'):
+        self.metrics.append(Value(name, documentation, kind, read))
+
+    def exposition(self):
+        return '\n'.join(line for metric in self.metrics for line in metric.collect()) + '\n'
+
+
+# -------------------------------------------------------------------------------------
+
+class SamplingProfiler:
+    def __init__(self, rate=0.0):
+        self.rate = rate
+        self.samples = 0
+        self._stats = None
+        # one profiled call at a time: the interpreter only runs one profiler per thread, and
+        # recent versions only one per process
+        self._running = threading.Lock()
+        self._merge = threading.Lock()
+
+    @contextmanager
+    def sample(self):
+        if self.rate <= 0 or random.random() >= self.rate or not self._running.acquire(blocking=False):
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            self._running.release()
+        with self._merge:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+
+    def report(self, limit=40):
+        with self._merge:
+            if self._stats is None:
+                return 'no samples (set ALLERVIS_PROFILE to a sampling rate, e.g. 0.01)\n'
+            output = io.StringIO()
+            self._stats.stream = output
+            output.write(f'{self.samples} sampled callbacks\n')
+            self._stats.sort_stats('cumulative').print_stats(limit)
+            return output.getvalue()
+
+
+# -------------------------------------------------------------------------------------
+
+registry = Registry()
+
+callback_seconds = registry.histogram(
+    'allervis_callback_seconds', 'Duration of the figure callbacks', ('callback', 'inputs'))
+stage_seconds = registry.histogram(
+    'allervis_stage_seconds', 'Duration of the stages of the figure callbacks', ('callback', 'stage'))
+response_bytes = registry.histogram(
+    'allervis_response_bytes', 'Size of the responses', ('endpoint',), buckets=bytes_buckets)
+encoded_bytes = registry.histogram(
+    'allervis_response_encoded_bytes', 'Size of the responses as sent, after compression (see encoding.py)',
+    ('endpoint', 'encoding'), buckets=bytes_buckets)
+
+profiler = SamplingProfiler()
+
+_current = threading.local()
+
+# the ids of the Dash callback outputs, the only `endpoint` labels taken from a callback payload (see register)
+_outputs = ()
+
+
+@contextmanager
+def callback(name, inputs=''):
+    # times a callback; the stages timed inside it are recorded under its name
+    outer = getattr(_current, 'callback', None)
+    _current.callback = name
+    start = time.perf_counter()
+    try:
+        with profiler.sample():
+            yield
+    finally:
+        callback_seconds.observe(time.perf_counter() - start, name, inputs)
+        _current.callback = outer
+
+
+def inputs_label(*values):
+    # the `inputs` label of a callback from (value, allowed values) pairs. Values sent by the client that are not
+    # allowed are recorded as 'other', so that forged callback payloads cannot add series without bound
+    return '/'.join(value if isinstance(value, str) and value in allowed else 'other' for value, allowed in values)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, getattr(_current, 'callback', None) or 'other', name)
+
+
+def endpoint():
+    # the Flask endpoint of the current request, the output id for Dash callbacks
+    if request.path.endswith('/_dash-update-component'):
+        payload = request.get_json(silent=True) or {}
+        output = payload.get('output') if isinstance(payload, dict) else None
+        return output if isinstance(output, str) and output in _outputs else 'other'
+    return request.endpoint or 'other'
+
+
+def register(server, outputs=()):
+    # `outputs`: the callback outputs of the Dash app (e.g. its `callback_map`)
+    global _outputs
+    _outputs = outputs
+    @server.route('/metrics')
+    def metrics():
+        return Response(registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/metrics/profile')
+    def profile():
+        return Response(profiler.report(request.args.get('limit', 40, type=int)), mimetype='text/plain')
+
+    @server.after_request
+    def record_size(response):
+        # streamed responses (the data API) have no length up front and are not counted
+        if response.content_length is not None and request.endpoint not in ('metrics', 'profile'):
+            response_bytes.observe(response.content_length, endpoint())
+        return response
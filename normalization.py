@@ -0,0 +1,117 @@
+import warnings
+
+import numpy as np
+
+
+# ------------------------------------------------------------------------------
+# Imputation and normalization strategies
+#
+# The build stage bakes one strategy into `concatenated.csv` and the artifact:
+# missing values take the median of the allergen (the minimum for nuts, which are
+# missing for most countries), then every allergen is divided by its maximum. The
+# artifact also keeps the raw values (see artifact.py), and any other strategy is
+# applied to them at query time: `DatasetSnapshot.year_matrix` computes the matrices
+# of a strategy on first use and shares them between requests.
+#
+# A strategy is named "<imputation>:<scaling>", e.g. "mean:zscore". Statistics are
+# taken over the countries, per year for the time series, except the scaling of the
+# time series which spans all years, so that years can be compared with each other.
+#
+# In the time series, the years a country has no value for already hold its nearest
+# earlier (else later) value when the build stage writes the raw cube, and that
+# includes the years a source does not span (e.g. nuts before 2012). Imputation only
+# fills the countries that have no value at all in a source.
+
+imputations = {
+    'median': 'Median (minimum for nuts)',
+    'mean': 'Mean',
+    'min': 'Minimum',
+    'zero': 'Zero',
+}
+
+scalings = {
+    'max': 'Share of the maximum',
+    'continent': 'Share of the continent maximum',
+    'minmax': 'Min-max',
+    'zscore': 'Z-score',
+    'none': 'Raw values',
+}
+
+default_imputation = 'median'
+default_scaling = 'max'
+default_strategy = f'{default_imputation}:{default_scaling}'
+
+
+def strategy_name(imputation=None, scaling=None):
+    return f'{imputation or default_imputation}:{scaling or default_scaling}'
+
+
+def parse(strategy):
+    # (imputation, scaling) of a strategy name, ValueError for unknown ones
+    imputation, _, scaling = (strategy or default_strategy).partition(':')
+    if imputation not in imputations or scaling not in scalings:
+        raise ValueError(f'Unknown strategy: {strategy}')
+    return imputation, scaling
+
+
+def options(labels):
+    return [{"label": label + ' ', "value": value} for value, label in labels.items()]
+
+
+# -------------------------------------------------------------------------------------
+
+def impute(values, allergens, imputation, nuts=()):
+    # the missing values of every allergen, filled over the countries (the last axis of each column)
+    values = np.array(values, dtype=np.float64)
+    for j, allergen in enumerate(allergens):
+        column = values[..., j]
+        if imputation == 'zero':
+            fill = 0.0
+        elif imputation == 'min' or (imputation == 'median' and allergen in nuts):
+            fill = np.nanmin(column, axis=-1, keepdims=True)
+        elif imputation == 'median':
+            fill = np.nanmedian(column, axis=-1, keepdims=True)
+        else:
+            fill = np.nanmean(column, axis=-1, keepdims=True)
+        column[...] = np.where(np.isnan(column), fill, column)
+    return values
+
+
+def _scale(column, scaling):
+    if scaling in ('max', 'continent'):
+        top = np.nanmax(column)
+        return column / top if top else column
+    if scaling == 'minmax':
+        low, high = np.nanmin(column), np.nanmax(column)
+        return (column - low) / (high - low) if high > low else column - low
+    if scaling == 'zscore':
+        std = np.nanstd(column)
+        return (column - np.nanmean(column)) / std if std else column - np.nanmean(column)
+    return column
+
+
+def scale(values, scaling, groups=None):
+    # every allergen scaled over all countries (and years), or within each group of `groups` (one per country)
+    values = np.array(values, dtype=np.float64)
+    for j in range(values.shape[-1]):
+        column = values[..., j]
+        if scaling == 'continent' and groups is not None:
+            for group in np.unique(groups):
+                rows = groups == group
+                column[..., rows] = _scale(column[..., rows], scaling)
+        else:
+            column[...] = _scale(column, scaling)
+    return values
+
+
+def apply(raw, allergens, strategy, groups=None, nuts=()):
+    """The allergen values of `raw` (countries x allergens, or years x countries x allergens, NaN where
+    missing) under `strategy`, as a read-only float32 array."""
+    imputation, scaling = parse(strategy)
+    with warnings.catch_warnings(), np.errstate(all='ignore'):
+        # allergens without any value in a year leave NaN statistics, zeroed below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        values = scale(impute(raw, allergens, imputation, nuts), scaling, groups)
+    values = np.nan_to_num(values).astype(np.float32)
+    values.setflags(write=False)
+    return values
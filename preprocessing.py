@@ -0,0 +1,248 @@
+"""Build stage for `concatenated.csv`.
+
+Reads the per-allergen Our World in Data CSVs, keeps the most recent value of every
+country, imputes and scales each allergen column and joins the continent of every
+country. The result is written as CSV and as the memory-mappable binary artifact
+the app loads at startup (see artifact.py). Source files are parsed in a process
+pool, and a manifest of file hashes makes re-runs incremental: only sources that
+changed since the last build are parsed again and merged into the previously
+extracted values.
+
+    python preprocessing.py [--force] [--workers N] [--data DIRECTORY]
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from artifact import artifact_lock, artifact_version, dataset_version, write_artifact
+from sources import data_path, allergen_paths, nuts, source_paths
+
+# ------------------------------------------------------------------------------
+# Build outputs
+#
+# The build state in `.build` holds the source hashes and the raw values (most recent
+# and yearly) extracted from each source.
+#
+# The imputed and scaled values of `concatenated.csv` are written with 15 significant
+# digits: a full or an incremental build, or a different order of the floating-point
+# operations, then writes the same text, and so the same dataset version.
+
+csv_float_format = '%.15g'
+
+BuildPaths = namedtuple('BuildPaths', ['sources', 'continents', 'output', 'artifact', 'build', 'manifest',
+                                       'most_recent', 'history'])
+
+
+def build_paths(directory):
+    build_directory = f'{directory}//.build'
+    return BuildPaths(sources=source_paths(directory),
+                      continents=f'{directory}//continents.csv',
+                      output=f'{directory}//concatenated.csv',
+                      artifact=f'{directory}//artifact',
+                      build=build_directory,
+                      manifest=f'{build_directory}//manifest.json',
+                      most_recent=f'{build_directory}//most_recent.csv',
+                      history=f'{build_directory}//history.csv')
+
+
+paths = build_paths(data_path)
+
+
+# ------------------------------------------------------------------------------
+# Stages
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_source(allergen, path):
+    df = pd.read_csv(path)
+    value_column = df.columns[-1]
+    df = df.dropna(subset=['Code'])
+
+    # the value of the last row of each (Code, Entity) group, i.e. the most recent year of every country
+    most_recent = df.drop_duplicates(['Code', 'Entity'], keep='last')
+    most_recent = most_recent.set_index(['Code', 'Entity'])[value_column].rename(allergen)
+
+    # and the value of every year
+    history = df.drop_duplicates(['Code', 'Year'], keep='last')
+    history = history.set_index(['Code', 'Year'])[value_column].rename(allergen)
+    return most_recent, history
+
+
+def impute_and_scale(concatenated):
+    # median imputation (the minimum for nuts, which are missing for most countries), then divide by the max
+    concatenated = concatenated.copy()
+    for column in concatenated.columns:
+        fill_value = concatenated[column].min() if column in nuts else concatenated[column].median()
+        concatenated[column] = concatenated[column].fillna(fill_value)
+        concatenated[column] /= concatenated[column].max()
+    return concatenated
+
+
+def country_history(history, codes, allergens):
+    """The years of the sources, and their raw allergen values of shape (countries x years x allergens), NaN
+    where a source has no value for a country and year.
+    """
+    years = np.array(sorted(history.index.get_level_values('Year').unique()), dtype=np.int16)
+    index = pd.MultiIndex.from_product([codes, years], names=['Code', 'Year'])
+    values = history.reindex(index)[list(allergens)].to_numpy(dtype=np.float64)
+    return years, values.reshape(len(codes), len(years), len(allergens))
+
+
+def fill_years(by_country):
+    """Per-year raw allergen values of shape (years x countries x allergens), NaN where missing.
+
+    A missing year of a country takes the value of its nearest earlier (else later) year, which
+    also covers the years a source does not span (e.g. nuts before 2012).
+    """
+    cube = by_country.transpose(1, 0, 2).copy()
+    years = cube.shape[0]
+
+    for t in range(1, years):
+        cube[t] = np.where(np.isnan(cube[t]), cube[t - 1], cube[t])
+    for t in range(years - 2, -1, -1):
+        cube[t] = np.where(np.isnan(cube[t]), cube[t + 1], cube[t])
+    return cube
+
+
+def build_cube(raw_cube, allergens):
+    """Per-year allergen values of shape (years x countries x allergens), imputed and scaled.
+
+    Countries without any value get the median (minimum for nuts) of that year, as in
+    `impute_and_scale`. Every allergen is divided by its maximum over all years, so that years can
+    be compared with each other.
+    """
+    cube = np.array(raw_cube, dtype=np.float64)
+    with np.errstate(all='ignore'):
+        for j, allergen in enumerate(allergens):
+            column = cube[:, :, j]
+            fill = np.nanmin(column, axis=1) if allergen in nuts else np.nanmedian(column, axis=1)
+            column[:] = np.where(np.isnan(column), fill[:, None], column)
+            column /= np.nanmax(column)
+    return np.nan_to_num(cube).astype(np.float32)
+
+
+def add_continents(concatenated, path=paths.continents):
+    continents = pd.read_csv(path, keep_default_na=False)
+    continents['Continent'] = continents['Continent'].replace({'NA': 'NAM'})
+
+    return concatenated.reset_index().merge(continents, how='left', left_on='Code', right_on='alpha3').drop(
+        columns=['alpha2', 'alpha3', 'numeric', 'fips', 'Country', 'Capital', 'Area in km²'])
+
+
+def write_atomically(path, write):
+    directory = os.path.dirname(path) or '.'
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def write_json(path, content):
+    with open(path, 'w') as f:
+        json.dump(content, f, indent=2)
+
+
+def load_manifest(paths=paths):
+    if not all(os.path.exists(path) for path in (paths.manifest, paths.most_recent, paths.history)):
+        return {}
+    with open(paths.manifest) as f:
+        return json.load(f)
+
+
+def changed_sources(manifest, hashes):
+    return [allergen for allergen in allergen_paths if manifest.get(allergen) != hashes[allergen]]
+
+
+def write_binary(concatenated, history, most_recent, paths=paths):
+    # the raw values are kept next to the imputed and scaled ones, for the other strategies of normalization.py,
+    # and as they are in the sources, country by country, for the history of a country (see history_store.py)
+    allergens = sorted(allergen_paths)
+    codes = concatenated['Code'].tolist()
+    years, by_country = country_history(history, codes, allergens)
+    raw_cube = fill_years(by_country)
+    raw = most_recent.reindex(pd.MultiIndex.from_frame(concatenated[['Code', 'Entity']]))[allergens]
+    write_artifact(concatenated, allergens, paths.artifact, dataset_version(paths.output),
+                   years=years, cube=build_cube(raw_cube, allergens), raw=raw.to_numpy(), raw_cube=raw_cube,
+                   history=by_country)
+
+
+def merge_previous(path, index_columns, changed, extracted):
+    # the re-parsed columns replace their previous version, the other columns are kept from the last build
+    if os.path.exists(path) and len(changed) < len(allergen_paths):
+        previous = pd.read_csv(path, index_col=index_columns).drop(columns=changed)
+        extracted = [previous[column] for column in previous.columns] + list(extracted)
+    merged = pd.concat(extracted, axis=1).dropna(how='all')
+    return merged[list(allergen_paths)].sort_index()
+
+
+def build(force=False, workers=None, directory=data_path):
+    """Rebuild `concatenated.csv` in `directory`, re-parsing only the sources that changed. Returns the re-parsed
+    allergens.
+
+    Holds the exclusive lock of the artifact meanwhile, so that concurrent builds (e.g. by the data watchers of
+    several workers, see reload.py) run one after the other and readers never load a half-written artifact.
+    `workers=0` parses the sources in this process instead of a process pool.
+    """
+    paths = build_paths(directory)
+    os.makedirs(paths.build, exist_ok=True)
+    with artifact_lock(paths.artifact, shared=False):
+        return _build(paths, force, workers)
+
+
+def _build(paths, force, workers):
+    hashes = {allergen: file_hash(path) for allergen, path in paths.sources.items()}
+    hashes['continents'] = file_hash(paths.continents)
+
+    manifest = {} if force else load_manifest(paths)
+    changed = changed_sources(manifest, hashes)
+    if not changed and manifest.get('continents') == hashes['continents'] and os.path.exists(paths.output):
+        if artifact_version(paths.artifact) != dataset_version(paths.output):
+            write_binary(pd.read_csv(paths.output), pd.read_csv(paths.history, index_col=['Code', 'Year']),
+                         pd.read_csv(paths.most_recent, index_col=['Code', 'Entity']), paths)
+        return []
+
+    if len(changed) > 1 and workers != 0:
+        with ProcessPoolExecutor(max_workers=workers or min(len(changed), os.cpu_count() or 1)) as pool:
+            extracted = list(pool.map(read_source, changed, [paths.sources[a] for a in changed]))
+    else:
+        extracted = [read_source(allergen, paths.sources[allergen]) for allergen in changed]
+
+    most_recent = merge_previous(paths.most_recent, ['Code', 'Entity'], changed, [e[0] for e in extracted])
+    history = merge_previous(paths.history, ['Code', 'Year'], changed, [e[1] for e in extracted])
+
+    concatenated = add_continents(impute_and_scale(most_recent), paths.continents)
+
+    write_atomically(paths.most_recent, lambda path: most_recent.to_csv(path))
+    write_atomically(paths.history, lambda path: history.to_csv(path))
+    write_atomically(paths.output, lambda path: concatenated.to_csv(path, index=False, float_format=csv_float_format))
+    write_binary(concatenated, history, most_recent, paths)
+    write_atomically(paths.manifest, lambda path: write_json(path, hashes))
+    return changed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--force', action='store_true', help='re-parse every source file')
+    parser.add_argument('--workers', type=int, default=None, help='size of the parsing process pool')
+    parser.add_argument('--data', default=data_path, help='the data folder to build')
+    args = parser.parse_args()
+
+    rebuilt = build(force=args.force, workers=args.workers, directory=args.data)
+    print(f'Re-processed {len(rebuilt)} source file(s): {", ".join(rebuilt) or "none"}')
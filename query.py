@@ -0,0 +1,41 @@
+from flask import abort, request
+
+import normalization
+
+
+# ------------------------------------------------------------------------------
+# Query parameters
+#
+# The parameters shared by the HTTP endpoints (export.py, data_api.py): the allergen
+# selection, the year and the normalization strategy, read from the query string of
+# the current request and checked against the dataset being served. Values the
+# dataset does not offer are answered with 400 rather than silently replaced.
+
+def selection(allergens, default):
+    # `allergens=Milk,Egg` or `allergens=Milk&allergens=Egg`; 400 for unknown ones
+    selected = [name for value in request.args.getlist('allergens') for name in value.split(',') if name]
+    if any(name not in allergens for name in selected):
+        abort(400, 'unknown allergen')
+    return sorted(set(selected or default))
+
+
+def requested_strategy(dataset):
+    # `imputation=mean&scaling=zscore` (see normalization.py); 400 for unknown or unavailable ones
+    imputation = request.args.get('imputation', normalization.default_imputation)
+    scaling = request.args.get('scaling', normalization.default_scaling)
+    strategy = normalization.strategy_name(imputation, scaling)
+    if imputation not in normalization.imputations or scaling not in normalization.scalings \
+            or (strategy != normalization.default_strategy and not dataset.strategies_available):
+        abort(400, 'unknown or unavailable normalization strategy')
+    return strategy
+
+
+def requested_year(dataset):
+    # `year=2010`, a year of the time series; None (the most recent values) when not given, 400 for the years the
+    # dataset does not cover, rather than the most recent values under the year asked for
+    if not request.args.get('year'):
+        return None
+    year = request.args.get('year', type=int)
+    if year is None or year not in dataset.years:
+        abort(400, 'year not in the time series')
+    return year
@@ -0,0 +1,112 @@
+import json
+
+import numpy as np
+
+
+# ------------------------------------------------------------------------------
+# Region index
+#
+# Every value of the `regions` dropdown maps to the row positions of its countries,
+# resolved once when the data is loaded, together with how the map should frame it
+# (a Plotly geo scope, and optionally a center and zoom). Filtering a table to a
+# region is then a single take of those positions, and ordering it only sorts the
+# region's own rows. New regions (subregions, user-defined groups of countries) are
+# added with `add` instead of another branch in the callbacks.
+
+# value, label, continent code in `concatenated.csv`, geo scope, geo settings
+default_regions = [
+    ('world', 'World ', None, 'world', {}),
+    ('europe', 'Europe ', 'EU', 'europe', {}),
+    ('asia', 'Asia ', 'AS', 'asia', {}),
+    ('africa', 'Africa ', 'AF', 'africa', {}),
+    ('north america', 'North America ', 'NAM', 'north america', {}),
+    ('south america', 'South America ', 'SA', 'south america', {}),
+    # Plotly has no oceania scope: zoom the world map onto it instead
+    ('oceania', 'Oceania ', 'OC', 'world', {'center': dict(lon=130, lat=-30), 'projection_scale': 3}),
+]
+
+
+class Region:
+    __slots__ = ('value', 'label', 'positions', 'scope', 'geo')
+
+    def __init__(self, value, label, positions, scope='world', geo=None):
+        self.value = value
+        self.label = label
+        self.positions = positions
+        self.scope = scope
+        self.geo = geo or {}
+
+    @property
+    def is_world(self):
+        return self.value == 'world'
+
+
+class RegionIndex:
+    def __init__(self, codes, continents):
+        self._codes = np.asarray(codes)
+        self._continents = np.asarray(continents)
+        self._positions_of_codes = {code: i for i, code in enumerate(self._codes)}
+        self._regions = {}
+
+    @classmethod
+    def build(cls, codes, continents, definitions=default_regions):
+        index = cls(codes, continents)
+        for value, label, continent, scope, geo in definitions:
+            if continent is None:
+                index.add(value, label, np.arange(len(index._codes)), scope, geo)
+            else:
+                index.add_continent(value, label, continent, scope, geo)
+        return index
+
+    def add(self, value, label, positions, scope='world', geo=None):
+        positions = np.sort(np.asarray(positions, dtype=np.intp))
+        positions.setflags(write=False)
+        self._regions[value] = Region(value, label, positions, scope, geo)
+
+    def add_continent(self, value, label, continent, scope='world', geo=None):
+        self.add(value, label, np.flatnonzero(self._continents == continent), scope, geo)
+
+    def add_countries(self, value, label, codes, scope='world', geo=None):
+        # codes that are not in the data are ignored
+        self.add(value, label, [self._positions_of_codes[code] for code in codes if code in self._positions_of_codes],
+                 scope, geo)
+
+    def load_groups(self, path):
+        # {"<value>": {"label": ..., "codes": [...], "scope": ..., "geo": {...}}, ...}
+        with open(path) as f:
+            for value, group in json.load(f).items():
+                self.add_countries(value, group.get('label', value), group['codes'],
+                                   group.get('scope', 'world'), group.get('geo'))
+
+    def __contains__(self, value):
+        return value in self._regions
+
+    def __getitem__(self, value):
+        return self._regions[value]
+
+    def get(self, value):
+        # the first region (the whole world) for values that are not indexed, e.g. a cleared dropdown
+        return self._regions.get(value) or next(iter(self._regions.values()))
+
+    def options(self):
+        return [{"label": region.label, "value": region.value} for region in self._regions.values()]
+
+    def position(self, code):
+        # the row of a country, None for codes that are not in the data
+        return self._positions_of_codes.get(code)
+
+    def containing(self, position, preferred=None):
+        # the region of a row for comparing it with its neighbours: `preferred` when it holds the row and is not
+        # the whole world, otherwise the first such region (its continent, for the default regions); None if none
+        candidates = [self._regions[preferred]] if preferred in self._regions else []
+        for region in candidates + list(self._regions.values()):
+            positions = region.positions
+            i = np.searchsorted(positions, position)
+            if not region.is_world and i < len(positions) and positions[i] == position:
+                return region
+        return None
+
+    def order(self, value, key):
+        # positions of the region's rows, ascending by `key` (one value per row of the whole table)
+        positions = self.get(value).positions
+        return positions[np.argsort(np.asarray(key)[positions], kind='stable')]
@@ -0,0 +1,127 @@
+import logging
+import os
+import threading
+
+from artifact import dataset_version
+from sources import source_files
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------------------------
+# Hot reload of the data
+#
+# With ALLERVIS_WATCH=<seconds>, every worker polls the data folder in a background
+# thread. When source files appear or change (and have stopped changing since the
+# previous poll, so that a file still being copied is not read), it runs the
+# incremental build of preprocessing.py: only the allergens whose files changed are
+# parsed again. When `concatenated.csv` no longer matches the dataset being served,
+# whichever worker rebuilt it, the new snapshot is loaded next to the old one and
+# handed to `on_reload`, which swaps it in with a single assignment. Requests that
+# are running keep the snapshot they started with.
+#
+# Builds hold an exclusive lock on the artifact (see artifact.py): the workers that
+# notice the same change build one after the other, the later ones finding nothing
+# left to parse, and no worker loads the artifact while it is being written.
+
+class DataWatcher:
+    def __init__(self, directory, load, on_reload, version='', interval=5.0, build=True):
+        self.directory = directory
+        self.load = load
+        self.on_reload = on_reload
+        self.version = version
+        self.interval = interval
+        self.build = build
+        self.rebuilt = []
+        self.builds = 0
+        self.reloads = 0
+        self.failures = 0
+
+        # changes made while the app was down are left to `python preprocessing.py`
+        self._seen = self._fingerprints()
+        self._pending = None
+        self._failed_version = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watched_paths(self):
+        return [f'{self.directory}//{name}' for name in list(source_files.values()) + ['continents.csv']]
+
+    def _fingerprints(self):
+        fingerprints = {}
+        for path in self.watched_paths():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            fingerprints[path] = (stat.st_mtime_ns, stat.st_size)
+        return fingerprints
+
+    def poll(self):
+        """One round of watching: rebuild when the sources changed, then reload. Returns True on reload."""
+        if self.build:
+            fingerprints = self._fingerprints()
+            if fingerprints != self._seen:
+                if fingerprints == self._pending:
+                    self._seen, self._pending = fingerprints, None
+                    self._rebuild(fingerprints)
+                else:
+                    # changed since the last poll: wait for the files to settle
+                    self._pending = fingerprints
+        return self._reload()
+
+    def _rebuild(self, fingerprints):
+        missing = len(self.watched_paths()) - len(fingerprints)
+        if missing:
+            logger.warning('Not rebuilding %s: %d source file(s) missing', self.directory, missing)
+            return
+        # only workers that watch the sources import the build stage
+        import preprocessing
+        try:
+            # parsed in this thread: forking a process pool from a threaded worker is not safe
+            self.rebuilt = preprocessing.build(workers=0, directory=self.directory)
+        except Exception:
+            self.failures += 1
+            logger.exception('Rebuilding %s failed', self.directory)
+            return
+        self.builds += 1
+        logger.info('Rebuilt %s: %s', self.directory, ', '.join(self.rebuilt) or 'nothing changed')
+
+    def _reload(self):
+        try:
+            version = dataset_version(f'{self.directory}//concatenated.csv')
+        except FileNotFoundError:
+            return False
+        if version == self.version or version == self._failed_version:
+            return False
+        try:
+            snapshot = self.load()
+        except Exception:
+            self.failures += 1
+            self._failed_version = version
+            logger.exception('Loading version %s of %s failed', version, self.directory)
+            return False
+        self.on_reload(snapshot)
+        self.version = snapshot.version
+        self.reloads += 1
+        logger.info('Reloaded %s: version %s', self.directory, snapshot.version)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Watching %s failed', self.directory)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='allervis-data-watcher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,156 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import normalization
+from aggregation import AllergenMatrix
+from artifact import artifact_lock, artifact_version, dataset_version, read_artifact, read_cube, read_history, read_raw
+from history_store import CountryHistoryStore
+from regions import RegionIndex
+from sources import nuts
+
+
+# ------------------------------------------------------------------------------
+# Read-only dataset snapshot
+#
+# The snapshot is loaded once at startup and shared by every request (and every
+# thread of a worker). Nothing in it is ever written after construction: the
+# allergen matrix is flagged read-only and callbacks only ever receive fresh
+# per-request views, which they are free to sort, filter and extend.
+#
+# When the binary artifact carries the time-series cube (years x countries x
+# allergens), the matrix of any year is a slice of the cube: switching years costs
+# no parsing, grouping or copying. The allergen rankings (see aggregation.py) of
+# the matrix and of each year of the cube are computed the first time a request
+# needs them, then kept: loading a worker does not pay for the years nobody views.
+#
+# The loaded matrices hold the default strategy of normalization.py. With the raw
+# values of the artifact, the matrices of any other strategy are computed the first
+# time a request asks for them, then kept and shared like the default ones.
+#
+# The history of every country, as in the sources, is looked up by ISO code in the
+# store of history_store.py; None when the dataset was loaded from the CSV.
+
+class DatasetSnapshot:
+    def __init__(self, frame, allergens, values=None, version='', years=None, cube=None, raw=None, raw_cube=None,
+                 history=None):
+        self.allergens = list(allergens)
+        self.version = version
+
+        frame = frame.reset_index(drop=True)
+        if values is None:
+            values = frame[self.allergens].to_numpy(dtype=np.float64)
+        self._frame = frame.drop(columns=[column for column in self.allergens if column in frame.columns])
+
+        self.matrix = AllergenMatrix(values, self.allergens, index=self._frame.index)
+        if self.matrix.values.flags.writeable:
+            self.matrix.values.setflags(write=False)
+
+        self.codes = self._read_only(self._frame['Code'].to_numpy())
+        self.entities = self._read_only(self._frame['Entity'].to_numpy())
+        self.continents = self._read_only(self._frame['Continent'].to_numpy())
+        self.continent_labels = sorted(pd.Series(self.continents).dropna().unique())
+        self.regions = RegionIndex.build(self.codes, self.continents)
+
+        self.years = [] if years is None else [int(year) for year in years]
+        self._year_positions = {year: t for t, year in enumerate(self.years)}
+        self.cube = cube
+
+        self._raw = raw
+        self._raw_cube = raw_cube
+        # strategy -> (matrix, cube, matrices of the years of the cube, each made on first use)
+        self._strategies = {normalization.default_strategy: (self.matrix, self.cube, [None] * len(self.years))}
+        self._strategies_lock = threading.Lock()
+
+        self.history = None
+        if history is not None and years is not None:
+            self.history = CountryHistoryStore(history, self.years, self.codes, self.allergens)
+
+    @staticmethod
+    def _read_only(values):
+        values = values.copy()
+        values.setflags(write=False)
+        return values
+
+    @classmethod
+    def read_csv(cls, path, allergens):
+        return cls(pd.read_csv(path), allergens, version=dataset_version(path))
+
+    @classmethod
+    def load(cls, data_path, allergens):
+        # the memory-mapped binary artifact when it was built from the current CSV, otherwise the CSV itself
+        csv_path = os.path.join(data_path, 'concatenated.csv')
+        artifact_path = os.path.join(data_path, 'artifact')
+
+        # not while a build (see preprocessing.py) is writing them
+        with artifact_lock(artifact_path):
+            version = dataset_version(csv_path)
+            if artifact_version(artifact_path) == version:
+                frame, values, meta = read_artifact(artifact_path)
+                if meta['allergens'] == list(allergens):
+                    years, cube = read_cube(artifact_path)
+                    raw, raw_cube = read_raw(artifact_path)
+                    return cls(frame, allergens, values=values, version=version, years=years, cube=cube,
+                               raw=raw, raw_cube=raw_cube, history=read_history(artifact_path))
+            return cls(pd.read_csv(csv_path), allergens, version=version)
+
+    def __len__(self):
+        return len(self._frame)
+
+    @property
+    def strategies_available(self):
+        # strategies other than the default need the raw values, only kept in the binary artifact
+        return self._raw is not None
+
+    def _strategy(self, strategy):
+        strategy = strategy or normalization.default_strategy
+        computed = self._strategies.get(strategy)
+        if computed is None:
+            # computed once: concurrent first requests for the same strategy wait for the first one
+            with self._strategies_lock:
+                computed = self._strategies.get(strategy)
+                if computed is None:
+                    computed = self._strategies[strategy] = self._compute(strategy)
+        return computed
+
+    def _compute(self, strategy):
+        normalization.parse(strategy)
+        if self._raw is None:
+            raise ValueError(f'Strategy {strategy} needs the raw values of the binary artifact')
+        continents = pd.factorize(self.continents)[0]
+        values = normalization.apply(self._raw, self.allergens, strategy, groups=continents, nuts=nuts)
+        matrix = AllergenMatrix(values, self.allergens, index=self._frame.index)
+        cube = None
+        if self._raw_cube is not None:
+            cube = normalization.apply(self._raw_cube, self.allergens, strategy, groups=continents, nuts=nuts)
+        return matrix, cube, [None] * len(self.years)
+
+    def year_matrix(self, year=None, strategy=None):
+        # the most recent values when no year is given (or the year is not covered), under `strategy`
+        # (a name of normalization.py, None for the default one); ValueError for unknown strategies
+        matrix, cube, year_matrices = self._strategy(strategy)
+        if year is None or year not in self._year_positions or cube is None:
+            return matrix
+        t = self._year_positions[year]
+        # kept, with its ranking once built; concurrent first requests may both make it, with the same result
+        if year_matrices[t] is None:
+            year_matrices[t] = AllergenMatrix(cube[t], self.allergens, index=self._frame.index)
+        return year_matrices[t]
+
+    def view(self, selected_allergens, year=None, strategy=None):
+        # a private copy of the base table with the allergen values and the aggregation for this selection
+        matrix = self.year_matrix(year, strategy)
+        aggregation = matrix.aggregate(selected_allergens).to_frame()
+        values = pd.DataFrame(matrix.values, columns=self.allergens, index=self._frame.index, copy=True)
+        return pd.concat([self._frame, values, aggregation], axis=1)
+
+    def animation_view(self, selected_allergens, strategy=None):
+        # one view per year of the cube, stacked into a long table with a 'Year' column
+        views = []
+        for year in self.years:
+            view = self.view(selected_allergens, year, strategy)
+            view.insert(0, 'Year', year)
+            views.append(view)
+        return pd.concat(views, ignore_index=True)
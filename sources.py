@@ -0,0 +1,43 @@
+# ------------------------------------------------------------------------------
+# Data sources
+#
+# Where the per-allergen source files live. Kept apart from the build stage in
+# `preprocessing.py`, so that serving the app only imports the paths.
+
+data_path = 'Food Allergies Data'
+source_files = {
+    'Beef': 'beef-and-buffalo-meat-consumption-per-person.csv',
+    'Seafood': 'fish-and-seafood-consumption-per-capita.csv',
+    'Egg': 'per-capita-egg-consumption-kilograms-per-year.csv',
+    'Milk': 'per-capita-milk-consumption.csv',
+
+    # nuts:
+    'Peanut': 'per-capita-peanut-consumption.csv',
+    'Almond': 'almond-consumption-per-capita.csv',
+    'Cashew': 'cashew-consumption-per-capita.csv',
+    'Hazelnut': 'hazelnuts-consumption-per-capita.csv',
+    'Macadamia': 'macadamia-consumption-per-capita.csv',
+    'Pecan': 'pecans-consumption-per-capita.csv',
+    'Pine': 'pine-nuts-consumption-per-capita.csv',
+    'Pistachio': 'pistachios-consumption-per-capita.csv',
+    'Walnut': 'walnuts-consumption-per-capita.csv',
+
+    # cereals:
+    'Barley': 'barley-consumption-per-capita.csv',
+    'Corn': 'corn-maize-consumption-per-capita.csv',
+    'Oat': 'oats-consumption-per-capita.csv',
+    'Rice': 'rice-consumption-per-capita.csv',
+    'Rye': 'rye-consumption-per-capita.csv',
+    'Wheat': 'wheat-consumption-per-capita.csv',
+
+}
+
+
+def source_paths(directory):
+    # the source file of every allergen in `directory` (e.g. a copy of the data folder)
+    return {allergen: f'{directory}//{name}' for allergen, name in source_files.items()}
+
+
+allergen_paths = source_paths(data_path)
+
+nuts = ['Peanut', 'Almond', 'Cashew', 'Hazelnut', 'Macadamia', 'Pecan', 'Pine', 'Pistachio', 'Walnut']